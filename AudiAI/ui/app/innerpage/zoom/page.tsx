@@ -52,12 +52,35 @@ export default function ZoomedVideoGenerator() {
         body: formData,
       });
 
+      if (response.status === 429) {
+        throw new Error("Server is busy, please try again in a moment.");
+      }
       if (!response.ok) {
         throw new Error("Failed to process video.");
       }
 
+      // The backend queues the video; poll until the job finishes
+      const { job_id } = await response.json();
+      let status = "queued";
+      while (status === "queued" || status === "processing") {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const statusResponse = await fetch(`http://localhost:8000/jobs/${job_id}`);
+        if (!statusResponse.ok) {
+          throw new Error("Failed to get processing status.");
+        }
+        status = (await statusResponse.json()).status;
+      }
+      if (status !== "complete") {
+        throw new Error("Failed to process video.");
+      }
+
+      const resultResponse = await fetch(`http://localhost:8000/jobs/${job_id}/result`);
+      if (!resultResponse.ok) {
+        throw new Error("Failed to download processed video.");
+      }
+
       // Receive the video file as a Blob from the backend
-      const data = await response.blob();
+      const data = await resultResponse.blob();
 
       // Log the response data (for debugging)
       console.log("Video Blob received: ", data);
@@ -1,109 +1,535 @@
-import cv2
-import numpy as np
-import uuid
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import FileResponse
-import shutil
-import os
-
-from fastapi.middleware.cors import CORSMiddleware
-
-app = FastAPI()
-
-# Allow all origins for testing; you can restrict this for production
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins (or specify domains)
-    allow_credentials=True,
-    allow_methods=["*"],  # Allow all HTTP methods
-    allow_headers=["*"],  # Allow all headers
-)
-
-
-UPLOAD_DIR = "uploads"
-OUTPUT_DIR = "processed"
-
-# Ensure directories exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-@app.post("/process-video/")
-async def process_video(file: UploadFile = File(...)):
-    # Save uploaded file
-    input_video_path = f"{UPLOAD_DIR}/{uuid.uuid4()}.mp4"
-    with open(input_video_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Process the video
-    output_video_path = f"{OUTPUT_DIR}/{uuid.uuid4()}_output.mp4"
-    process_zoom_tracking(input_video_path, output_video_path)
-
-    # Return the processed video
-    return FileResponse(output_video_path, media_type="video/mp4")
-
-def process_zoom_tracking(input_video_path, output_video_path):
-    cap = cv2.VideoCapture(input_video_path)
-
-    if not cap.isOpened():
-        print("Error: Could not open video.")
-        return
-
-    ret, frame = cap.read()
-    if not ret:
-        print("Error: Couldn't read the video frame.")
-        return
-
-    frame_h, frame_w = frame.shape[:2]
-    zoomed_h = frame_h
-    zoomed_w = int(frame_h * (9 / 16))  # Convert to 16:9 ratio
-
-    bbox = cv2.selectROI("Select Object to Track", frame, fromCenter=False, showCrosshair=True)
-    cv2.destroyAllWindows()
-
-    tracker = cv2.legacy.TrackerCSRT_create()
-    tracker.init(frame, bbox)
-
-    zoom_factor = 1.4
-    smooth_x, smooth_y = bbox[0], bbox[1]
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_video_path, fourcc, 30.0, (zoomed_w, zoomed_h))
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        success, bbox = tracker.update(frame)
-
-        if success:
-            x, y, w, h = [int(v) for v in bbox]
-            smooth_x = int(0.8 * smooth_x + 0.2 * x)
-            smooth_y = int(0.8 * smooth_y + 0.2 * y)
-            obj_center_x = smooth_x + w // 2
-            obj_center_y = smooth_y + h // 2
-        else:
-            obj_center_x = frame_w // 2
-            obj_center_y = frame_h // 2
-            smooth_x = int(0.9 * smooth_x + 0.1 * obj_center_x)
-            smooth_y = int(0.9 * smooth_y + 0.1 * obj_center_y)
-
-        zoom_w_scaled = int(zoomed_w / zoom_factor)
-        zoom_h_scaled = int(zoomed_h / zoom_factor)
-
-        x1 = max(0, obj_center_x - zoom_w_scaled // 2)
-        y1 = max(0, obj_center_y - zoom_h_scaled // 2)
-        x2 = min(frame_w, obj_center_x + zoom_w_scaled // 2)
-        y2 = min(frame_h, obj_center_y + zoom_h_scaled // 2)
-
-        cropped = frame[y1:y2, x1:x2]
-        zoomed_frame = cv2.resize(cropped, (zoomed_w, zoomed_h), interpolation=cv2.INTER_LINEAR)
-
-        out.write(zoomed_frame)
-
-    cap.release()
-    out.release()
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+import asyncio
+import cv2
+import json
+import math
+import numpy as np
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import FastAPI, File, Form, HTTPException, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+import shutil
+import os
+
+from fastapi.middleware.cors import CORSMiddleware
+
+from cache import ResultCache
+from crop import DEFAULT_FORMAT, CropPlanner, output_size, plan_crop_path, render_tiles, tile_bounds
+from detector import center_box, detect_subjects
+from jobs import JobQueue, QueueFullError
+from metrics import MetricsRegistry, StageTimer, combine_summaries
+from pipeline import run_pipeline
+from segments import concat_segments, split_at_keyframes
+from tracking import TRACKER_BACKENDS, MultiSubjectTracker, record_trajectory
+from writers import WRITER_BACKENDS, X264_PRESETS, open_writer
+
+app = FastAPI()
+
+# Allow all origins for testing; you can restrict this for production
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Allow all origins (or specify domains)
+    allow_credentials=True,
+    allow_methods=["*"],  # Allow all HTTP methods
+    allow_headers=["*"],  # Allow all headers
+)
+
+
+UPLOAD_DIR = "uploads"
+OUTPUT_DIR = "processed"
+
+# Number of videos encoded in parallel, and how many more may wait for a worker
+MAX_WORKERS = int(os.environ.get("AIZOOM_MAX_WORKERS", os.cpu_count() or 1))
+MAX_PENDING_JOBS = int(os.environ.get("AIZOOM_MAX_PENDING_JOBS", 16))
+# Finished jobs are forgotten after this long, or oldest first once there are more than AIZOOM_MAX_FINISHED_JOBS
+JOB_TTL_SECONDS = float(os.environ.get("AIZOOM_JOB_TTL_HOURS", 24)) * 3600
+MAX_FINISHED_JOBS = int(os.environ.get("AIZOOM_MAX_FINISHED_JOBS", 1000))
+
+# Default scale of the proxy frame the tracker runs on (1.0 = full resolution)
+TRACK_SCALE = float(os.environ.get("AIZOOM_TRACK_SCALE", 1.0))
+
+# Run the full tracker every this many frames, optical flow in between (1 = every frame)
+TRACK_STRIDE = int(os.environ.get("AIZOOM_TRACK_STRIDE", 1))
+MAX_TRACK_STRIDE = 30
+
+# Tracker backend: csrt, kcf, mosse, mil, or "auto" to pick the most robust one that keeps up with the video
+TRACKER = os.environ.get("AIZOOM_TRACKER", "csrt")
+
+# Segment-parallel mode: most worker processes per video, and the shortest segment worth splitting off
+MAX_SEGMENT_WORKERS = os.cpu_count() or 1
+MIN_SEGMENT_SECONDS = 2.0
+
+# Most outputs and tracked subjects one upload may ask for
+MAX_FORMATS = 8
+MAX_SUBJECTS = 4
+LAYOUTS = ("separate", "split")
+
+# Output encoder: "ffmpeg" (H.264 + source audio), "opencv" (mp4v, no audio) or "auto"
+WRITER_BACKEND = os.environ.get("AIZOOM_WRITER", "auto")
+
+# Disk budget shared by uploads/ and processed/; least recently used files are evicted past it
+CACHE_MAX_BYTES = int(float(os.environ.get("AIZOOM_CACHE_MAX_GB", 20)) * 1024 ** 3)
+
+# Results of running jobs are streamed as the encoder appends to them
+STREAM_CHUNK_SIZE = 256 * 1024
+STREAM_POLL_SECONDS = 0.25
+
+# Ensure directories exist
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+job_queue = JobQueue(max_workers=MAX_WORKERS, max_pending=MAX_PENDING_JOBS, job_ttl=JOB_TTL_SECONDS,
+                     max_finished=MAX_FINISHED_JOBS)
+result_cache = ResultCache(UPLOAD_DIR, OUTPUT_DIR, CACHE_MAX_BYTES)
+metrics_registry = MetricsRegistry()
+# Cache key -> id of the job producing it, so identical uploads share one queued or running job
+cache_jobs = {}
+
+@app.on_event("shutdown")
+def shutdown_job_queue():
+    job_queue.shutdown()
+
+@app.post("/process-video/", status_code=202)
+async def process_video(response: Response, file: UploadFile = File(...), bbox: str = Form(None),
+                        track_scale: float = Form(None), two_pass: bool = Form(False),
+                        writer: str = Form(None), x264_preset: str = Form("veryfast"),
+                        crf: int = Form(23), formats: str = Form(None), subjects: int = Form(None),
+                        layout: str = Form("separate"), track_stride: int = Form(None),
+                        segment_workers: int = Form(1), tracker: str = Form(None),
+                        target_fps: float = Form(None)):
+    # Optional starting box(es) as JSON [x, y, w, h] or [[x, y, w, h], ...]; otherwise detected
+    if bbox is not None:
+        bbox = parse_bbox(bbox)
+        if subjects is not None and subjects != len(bbox):
+            raise HTTPException(status_code=400, detail="subjects doesn't match the number of boxes")
+        subjects = len(bbox)
+    if subjects is None:
+        subjects = 1
+    if not 1 <= subjects <= MAX_SUBJECTS:
+        raise HTTPException(status_code=400, detail=f"subjects must be between 1 and {MAX_SUBJECTS}")
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
+    if not 1 <= segment_workers <= MAX_SEGMENT_WORKERS:
+        raise HTTPException(status_code=400, detail=f"segment_workers must be between 1 and {MAX_SEGMENT_WORKERS}")
+    if segment_workers > 1 and (bbox is not None or subjects > 1):
+        # Later segments re-detect their subject, so neither a box nor several subjects carry over
+        raise HTTPException(status_code=400, detail="segment_workers needs a single detected subject, without bbox")
+    if track_scale is None:
+        track_scale = TRACK_SCALE
+    if not 0 < track_scale <= 1:
+        raise HTTPException(status_code=400, detail="track_scale must be in (0, 1]")
+    if tracker is None:
+        tracker = TRACKER
+    if tracker != "auto" and tracker not in TRACKER_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"tracker must be auto or one of {', '.join(TRACKER_BACKENDS)}")
+    if target_fps is not None and not (math.isfinite(target_fps) and target_fps > 0):
+        raise HTTPException(status_code=400, detail="target_fps must be a positive number")
+    if track_stride is None:
+        track_stride = TRACK_STRIDE
+    if not 1 <= track_stride <= MAX_TRACK_STRIDE:
+        raise HTTPException(status_code=400, detail=f"track_stride must be between 1 and {MAX_TRACK_STRIDE}")
+    if writer is None:
+        writer = WRITER_BACKEND
+    if writer not in WRITER_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"writer must be one of {', '.join(WRITER_BACKENDS)}")
+    if x264_preset not in X264_PRESETS:
+        raise HTTPException(status_code=400, detail=f"x264_preset must be one of {', '.join(X264_PRESETS)}")
+    if not 0 <= crf <= 51:
+        raise HTTPException(status_code=400, detail="crf must be between 0 and 51")
+    # Optional list of outputs, e.g. [{"aspect": "9:16", "zoom": 1.4}, {"aspect": "1:1"}]
+    formats = parse_formats(formats) if formats is not None else [DEFAULT_FORMAT]
+
+    # Save the upload under the hash of its bytes, computed while it is copied in chunks off the event loop.
+    # It stays pinned until the finally below, so a finishing job's eviction can't delete it meanwhile.
+    content_hash, input_video_path = await run_in_threadpool(result_cache.save_upload, file.file)
+    try:
+        await run_in_threadpool(check_output_sizes, input_video_path, formats, subjects, layout)
+        cache_key = result_cache.result_key(content_hash, {
+            "bbox": bbox, "track_scale": track_scale, "two_pass": two_pass, "writer": writer,
+            "x264_preset": x264_preset, "crf": crf, "formats": formats, "subjects": subjects,
+            "layout": layout, "track_stride": track_stride, "segment_workers": segment_workers,
+            "tracker": tracker, "target_fps": target_fps,
+        })
+
+        output_name = result_cache.output_prefix(cache_key)
+        output_video_paths = []
+        for aspect_w, aspect_h, _, tiles in plan_outputs(formats, subjects, layout):
+            suffix = "" if subjects == 1 else "_split" if len(tiles) > 1 else f"_s{tiles[0]}"
+            output_video_paths.append(f"{output_name}_{aspect_w}x{aspect_h}{suffix}_output.mp4")
+
+        # Same clip with the same parameters: reuse the finished outputs or the job already producing them
+        if result_cache.lookup(cache_key, output_video_paths):
+            job_id = job_queue.add_finished(output_paths=output_video_paths, result=load_job_summary(cache_key))
+            response.status_code = 200
+            return {"job_id": job_id, "status": "complete", "cached": True}
+        job_id = cache_jobs.get(cache_key)
+        status = job_queue.status(job_id) if job_id is not None else None
+        if status is not None and status["status"] in ("queued", "processing"):
+            return {"job_id": job_id, "status": status["status"]}
+
+        # Neither the upload nor the outputs may be evicted while the job needs them
+        result_cache.pin(input_video_path, cache_key)
+
+        # Hand the video to the worker pool and return straight away
+        # Long videos can be split into keyframe-aligned segments processed on several cores
+        process_fn = process_zoom_tracking
+        extra_args = {}
+        # Single-pass ffmpeg output is fragmented MP4, so the result can be streamed while it's rendered
+        progressive = writer == "ffmpeg" or writer == "auto" and shutil.which("ffmpeg") is not None
+        if segment_workers > 1:
+            process_fn = process_in_segments
+            extra_args["segment_workers"] = segment_workers
+            progressive = False
+        elif progressive:
+            extra_args["fragmented"] = True
+        try:
+            job_id = job_queue.submit(
+                process_fn, input_video_path, output_video_paths, **extra_args,
+                bbox=bbox, track_scale=track_scale, track_stride=track_stride, two_pass=two_pass,
+                tracker_backend=tracker, target_fps=target_fps,
+                writer=writer, x264_preset=x264_preset, crf=crf, formats=formats,
+                subjects=subjects, layout=layout, output_paths=output_video_paths,
+            )
+        except QueueFullError:
+            result_cache.finish(input_video_path, cache_key, output_video_paths, success=False)
+            raise HTTPException(status_code=429, detail="Too many videos queued, try again later")
+        except BaseException:
+            result_cache.finish(input_video_path, cache_key, output_video_paths, success=False)
+            raise
+
+        job = job_queue.get(job_id)
+        job["progressive"] = progressive
+        cache_jobs[cache_key] = job_id
+        job["future"].add_done_callback(
+            lambda future: finish_cached_job(input_video_path, cache_key, output_video_paths, future))
+
+        return {"job_id": job_id, "status": "queued"}
+    finally:
+        # The upload came back pinned; any job started above holds its own pin
+        result_cache.unpin_upload(input_video_path)
+
+def finish_cached_job(input_video_path, cache_key, output_video_paths, future):
+    success = not future.cancelled() and future.exception() is None
+    if success:
+        summary = future.result()
+        metrics_registry.record_job(summary)
+        with open(f"{result_cache.output_prefix(cache_key)}_metrics.json", "w") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        metrics_registry.record_failure()
+    result_cache.finish(input_video_path, cache_key, output_video_paths, success)
+    cache_jobs.pop(cache_key, None)
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = job_queue.get(job_id)
+    status = job_queue.status(job_id)
+    if job is None or status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if status["status"] == "complete":
+        output_count = len(job["output_paths"])
+        status["results"] = [f"/jobs/{job_id}/result?index={i}" for i in range(output_count)]
+        status["metrics"] = job["future"].result()
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text format; totals cover jobs finished by this server process
+    text = metrics_registry.render(gauges={"aizoom_jobs_active": job_queue.active})
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, index: int = 0):
+    job = job_queue.get(job_id)
+    status = job_queue.status(job_id)
+    if job is None or status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    in_progress = status["status"] in ("queued", "processing")
+    if status["status"] != "complete" and not (in_progress and job.get("progressive")):
+        raise HTTPException(status_code=409, detail=f"Job is {status['status']}")
+
+    output_video_paths = job["output_paths"]
+    if not 0 <= index < len(output_video_paths):
+        raise HTTPException(status_code=404, detail="No output with that index")
+    output_video_path = output_video_paths[index]
+    if in_progress:
+        # Fragmented MP4 plays from the start while later fragments are still being written
+        return StreamingResponse(follow_output(output_video_path, job["future"]), media_type="video/mp4")
+    if not os.path.exists(output_video_path):
+        raise HTTPException(status_code=410, detail="Result was evicted from the cache, upload the video again")
+    result_cache.touch_result(output_video_path)
+    # Return the processed video
+    return FileResponse(output_video_path, media_type="video/mp4")
+
+async def follow_output(path, future):
+    # Yields the file as the encoder appends to it, until the job is done and all of it has been sent
+    while not os.path.exists(path):
+        if future.done():
+            return
+        await asyncio.sleep(STREAM_POLL_SECONDS)
+    with open(path, "rb") as f:
+        while True:
+            done = future.done()
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            elif done:
+                return
+            else:
+                await asyncio.sleep(STREAM_POLL_SECONDS)
+
+def load_job_summary(cache_key):
+    # The metrics summary a previous job saved with its outputs, if it's still there
+    try:
+        with open(f"{result_cache.output_prefix(cache_key)}_metrics.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def parse_bbox(value):
+    # Returns a list of boxes; a single [x, y, w, h] is one subject
+    error = "bbox must be a JSON array [x, y, w, h] or a list of them"
+    try:
+        boxes = json.loads(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=error)
+
+    if isinstance(boxes, list) and boxes and not isinstance(boxes[0], list):
+        boxes = [boxes]
+    if not isinstance(boxes, list) or not 0 < len(boxes) <= MAX_SUBJECTS:
+        raise HTTPException(status_code=400, detail=error)
+    for bbox in boxes:
+        # JSON allows NaN and overflows like 1e999 to inf, and bools are ints to Python
+        if (not isinstance(bbox, list) or len(bbox) != 4
+                or not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+                           for v in bbox)):
+            raise HTTPException(status_code=400, detail=error)
+        if bbox[2] <= 0 or bbox[3] <= 0:
+            raise HTTPException(status_code=400, detail="bbox width and height must be positive")
+    return [tuple(int(v) for v in bbox) for bbox in boxes]
+
+def plan_outputs(formats, subjects, layout):
+    """List the output videos as (aspect_w, aspect_h, zoom_factor, subject indices).
+
+    "separate" gives one video per subject per format; "split" gives one video per
+    format with every subject in its own tile, stacked top to bottom.
+    """
+    if layout == "split":
+        return [(aspect_w, aspect_h, zoom, list(range(subjects))) for aspect_w, aspect_h, zoom in formats]
+    return [(aspect_w, aspect_h, zoom, [subject])
+            for subject in range(subjects) for aspect_w, aspect_h, zoom in formats]
+
+def parse_formats(value):
+    error = 'formats must be a JSON array like [{"aspect": "9:16", "zoom": 1.4}]'
+    try:
+        items = json.loads(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=error)
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_FORMATS:
+        raise HTTPException(status_code=400, detail=f"{error}, with 1 to {MAX_FORMATS} entries")
+
+    formats = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail=error)
+        zoom_factor = item.get("zoom", DEFAULT_FORMAT[2])
+        # A JSON number; bools are ints to Python
+        if not isinstance(zoom_factor, (int, float)) or isinstance(zoom_factor, bool):
+            raise HTTPException(status_code=400, detail="zoom must be a number")
+        try:
+            aspect_w, aspect_h = (int(v) for v in str(item.get("aspect", "9:16")).split(":"))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=error)
+        if aspect_w <= 0 or aspect_h <= 0 or not (math.isfinite(zoom_factor) and zoom_factor > 0):
+            raise HTTPException(status_code=400, detail="aspect and zoom must be positive numbers")
+        formats.append((aspect_w, aspect_h, float(zoom_factor)))
+    return formats
+
+def check_output_sizes(input_video_path, formats, subjects, layout):
+    # Aspect ratios far from the source's can round an output, or one of its tiles, down to nothing
+    cap = cv2.VideoCapture(input_video_path)
+    frame_w, frame_h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    if not frame_w or not frame_h:
+        # Unreadable uploads fail in the job itself
+        return
+    for aspect_w, aspect_h, _, tiles in plan_outputs(formats, subjects, layout):
+        zoomed_w, zoomed_h = output_size(frame_w, frame_h, aspect_w, aspect_h)
+        if zoomed_w == 0 or zoomed_h // len(tiles) < 2:
+            raise HTTPException(status_code=400,
+                                detail=f"aspect {aspect_w}:{aspect_h} is too extreme for a {frame_w}x{frame_h} video")
+
+def process_zoom_tracking(input_video_path, output_video_path, bbox=None, select_roi=False,
+                          track_scale=1.0, two_pass=False, writer="auto", x264_preset="veryfast",
+                          crf=23, formats=None, subjects=1, layout="separate", track_stride=1,
+                          tracker_backend="csrt", target_fps=None, fragmented=False, return_trajectory=False):
+    # bbox may be one (x, y, w, h) box or a list with one box per subject.
+    # With return_trajectory the summary also holds "trajectory", the tracked boxes as
+    # an (N, subjects, 4) array with one row per frame and NaN where tracking failed.
+    bboxes = [bbox] if bbox is not None and not isinstance(bbox[0], (list, tuple)) else bbox
+    if bboxes is not None:
+        subjects = len(bboxes)
+
+    # Every output comes from the same decode and tracking pass
+    outputs = plan_outputs(formats or [DEFAULT_FORMAT], subjects, layout)
+    output_video_paths = [output_video_path] if isinstance(output_video_path, str) else output_video_path
+    if len(output_video_paths) != len(outputs):
+        raise ValueError(f"Need exactly {len(outputs)} output paths.")
+
+    timer = StageTimer()
+    started = time.perf_counter()
+    frame_count = 0
+    cap = cv2.VideoCapture(input_video_path)
+
+    if not cap.isOpened():
+        raise RuntimeError("Could not open video.")
+
+    ret, frame = cap.read()
+    if not ret:
+        raise RuntimeError("Couldn't read the video frame.")
+
+    # Keep the source frame rate; some containers don't report one
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_h, frame_w = frame.shape[:2]
+    output_sizes = [output_size(frame_w, frame_h, aspect_w, aspect_h) for aspect_w, aspect_h, _, _ in outputs]
+
+    if select_roi:
+        # Interactive use only; needs a display
+        bboxes = list(cv2.selectROIs("Select Objects to Track", frame, fromCenter=False, showCrosshair=True))
+        cv2.destroyAllWindows()
+        if len(bboxes) != subjects:
+            raise RuntimeError(f"Select exactly {subjects} objects.")
+    elif bboxes is None:
+        bboxes = detect_subjects(frame, subjects)
+        # Not enough people found: track the middle of the frame for the rest
+        bboxes += [center_box(frame)] * (subjects - len(bboxes))
+
+    # In auto mode the backend is chosen over the first second of video; by default it must keep up with playback
+    tracker = MultiSubjectTracker(frame, bboxes, scale=track_scale, stride=track_stride, backend=tracker_backend,
+                                  target_fps=target_fps or fps, calibration_frames=int(round(fps)))
+
+    # Crop windows are planned per tile; a plain output is a single full-size tile
+    tiles = []
+    for (zoomed_w, zoomed_h), (_, _, zoom_factor, subject_indices) in zip(output_sizes, outputs):
+        bounds = tile_bounds(zoomed_h, len(subject_indices))
+        tiles.append([(subject, zoomed_w, y1 - y0, zoom_factor) for subject, (y0, y1) in zip(subject_indices, bounds)])
+
+    try:
+        if two_pass:
+            # Pass 1 only tracks; the whole path is then smoothed at once and pass 2 just renders
+            first_boxes = np.array(bboxes, dtype=np.float64).reshape(1, -1, 4)
+            trajectory = np.concatenate([first_boxes, record_trajectory(cap, tracker, timer=timer)])
+            cap.release()
+            paths = [[plan_crop_path(trajectory[:, subject], frame_w, frame_h, tile_w, tile_h, zoom_factor)
+                      for subject, tile_w, tile_h, zoom_factor in output_tiles] for output_tiles in tiles]
+
+            cap = cv2.VideoCapture(input_video_path)
+            first_frame = None
+            frame_index = 0
+
+            track_stage = "plan"
+
+            def track(frame):
+                nonlocal frame_index, frame_count
+                index = min(frame_index, len(trajectory) - 1)
+                frame_index += 1
+                frame_count += 1
+                return [[windows[index] for windows in output_paths] for output_paths in paths]
+        else:
+            # The frame the tracker was initialised on is rendered too
+            first_frame = frame
+            planners = [[(subject, CropPlanner(frame_w, frame_h, tile_w, tile_h, bboxes[subject], zoom_factor))
+                         for subject, tile_w, tile_h, zoom_factor in output_tiles] for output_tiles in tiles]
+
+            track_stage = "track"
+            recorded = [] if return_trajectory else None
+
+            def track(frame):
+                nonlocal frame_count
+                frame_count += 1
+                results = tracker.update(frame)
+                if recorded is not None:
+                    recorded.append([bbox if success else (np.nan,) * 4 for success, bbox in results])
+                return [[planner.next_window(*results[subject]) for subject, planner in output_planners]
+                        for output_planners in planners]
+
+        writers = []
+        try:
+            for path, (zoomed_w, zoomed_h) in zip(output_video_paths, output_sizes):
+                writers.append(open_writer(path, zoomed_w, zoomed_h, fps, backend=writer,
+                                           audio_source=input_video_path, preset=x264_preset, crf=crf,
+                                           fragmented=fragmented))
+
+            pipeline_outputs = [((zoomed_h, zoomed_w, 3), out.write)
+                                for (zoomed_w, zoomed_h), out in zip(output_sizes, writers)]
+            run_pipeline(cap, frame.shape, track, render_tiles, pipeline_outputs, first_frame=first_frame,
+                         timer=timer, track_stage=track_stage)
+        finally:
+            for out in writers:
+                out.release()
+    finally:
+        cap.release()
+        tracker.close()
+
+    # Per-job summary; the server adds it to its /metrics totals and saves it next to the outputs
+    seconds = time.perf_counter() - started
+    summary = {
+        "frames": frame_count,
+        "seconds": seconds,
+        "fps": frame_count / seconds if seconds > 0 else 0.0,
+        "tracker_failures": sum(t.failures for t in tracker.trackers),
+        "tracker_backends": [t.backend for t in tracker.trackers],
+        "stages": timer.summary(),
+    }
+    if return_trajectory:
+        if not two_pass:
+            trajectory = np.array(recorded, dtype=np.float64).reshape(-1, len(tracker.trackers), 4)
+        summary["trajectory"] = trajectory
+    return summary
+
+def process_in_segments(input_video_path, output_video_path, segment_workers, bbox=None, subjects=1, **kwargs):
+    """Run process_zoom_tracking on keyframe-aligned segments in parallel and join the results.
+
+    Each segment runs in its own worker process with a fresh tracker that
+    detects its subject on the segment's first frame. Nothing links the
+    detections across segments, so only a single detected subject is supported:
+    a bbox or several subjects raise ValueError. The processed segments are
+    concatenated without re-encoding.
+    """
+    if bbox is not None or subjects > 1:
+        raise ValueError("Segmented processing supports a single detected subject only.")
+    started = time.perf_counter()
+    output_video_paths = [output_video_path] if isinstance(output_video_path, str) else output_video_path
+
+    cap = cv2.VideoCapture(input_video_path)
+    if not cap.isOpened():
+        raise RuntimeError("Could not open video.")
+    duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+    cap.release()
+
+    segment_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(output_video_paths[0]) or ".")
+    try:
+        segment_seconds = max(MIN_SEGMENT_SECONDS, duration / segment_workers)
+        segments = split_at_keyframes(input_video_path, segment_dir, segment_seconds)
+        if not segments:
+            raise RuntimeError("Could not split video into segments.")
+
+        segment_outputs = [[os.path.join(segment_dir, f"out_{i:04d}_{j}.mp4") for j in range(len(output_video_paths))]
+                           for i in range(len(segments))]
+        with ProcessPoolExecutor(max_workers=min(segment_workers, len(segments))) as pool:
+            futures = [
+                pool.submit(process_zoom_tracking, segment, outputs, **kwargs)
+                for segment, outputs in zip(segments, segment_outputs)
+            ]
+            summaries = [future.result() for future in futures]
+
+        for j, path in enumerate(output_video_paths):
+            concat_segments([outputs[j] for outputs in segment_outputs], path)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    return combine_summaries(summaries, time.perf_counter() - started)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
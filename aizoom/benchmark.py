@@ -0,0 +1,364 @@
+"""Offline benchmarks for the aizoom tracking pipeline.
+
+Clips are generated synthetically so runs are deterministic and need no test
+footage. Usage:
+
+    python benchmark.py proxy-scale --height 1080 --frames 150
+    python benchmark.py crop --height 1080
+    python benchmark.py stride --height 1080 --frames 150
+    python benchmark.py backends --height 720
+    python benchmark.py suite --save-baseline baseline.json
+    python benchmark.py suite --baseline baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from crop import CropPlanner, render_crop
+from tracking import TRACKER_BACKENDS, SubjectTracker
+
+
+def synthetic_clip(width, height, num_frames, seed=0, scenario="motion"):
+    """Yield (frame, ground_truth_bbox) for a textured patch moving over a noisy background.
+
+    scenario "occlusion" adds a static pillar the patch passes behind, and
+    "scaling" makes the patch grow and shrink as it moves. The ground truth is
+    always the patch's true box, hidden or not.
+    """
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+
+    obj_w, obj_h = width // 12, height // 5
+    patch = cv2.GaussianBlur(rng.integers(0, 256, (obj_h, obj_w, 3), dtype=np.uint8), (0, 0), 2)
+    cv2.rectangle(patch, (0, 0), (obj_w - 1, obj_h - 1), (0, 0, 255), max(2, obj_w // 20))
+    pillar_x, pillar_w = width // 2 - obj_w // 2, obj_w * 3 // 2
+
+    frame = np.empty_like(background)
+    for i in range(num_frames):
+        t = i / max(1, num_frames - 1)
+        sprite = patch
+        if scenario == "scaling":
+            size = 1.0 + 0.4 * np.sin(2 * np.pi * t)
+            sprite = cv2.resize(patch, (max(2, int(obj_w * size)), max(2, int(obj_h * size))))
+        h, w = sprite.shape[:2]
+        # Sweep left to right with a vertical bob
+        x = int((width - w) * (0.1 + 0.8 * t))
+        y = int((height - h) * (0.5 + 0.3 * np.sin(4 * np.pi * t)))
+
+        np.copyto(frame, background)
+        frame[y:y + h, x:x + w] = sprite
+        if scenario == "occlusion":
+            frame[:, pillar_x:pillar_x + pillar_w] = 128
+        yield frame, (x, y, w, h)
+
+
+def center_error(bbox, gt):
+    return np.hypot((bbox[0] + bbox[2] / 2) - (gt[0] + gt[2] / 2),
+                    (bbox[1] + bbox[3] / 2) - (gt[1] + gt[3] / 2))
+
+
+def iou(bbox, gt):
+    x1, y1 = max(bbox[0], gt[0]), max(bbox[1], gt[1])
+    x2, y2 = min(bbox[0] + bbox[2], gt[0] + gt[2]), min(bbox[1] + bbox[3], gt[1] + gt[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = bbox[2] * bbox[3] + gt[2] * gt[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def run_tracker(width, height, num_frames, scenario="motion", **tracker_kwargs):
+    clip = synthetic_clip(width, height, num_frames, scenario=scenario)
+    frame, gt = next(clip)
+    tracker = SubjectTracker(frame, gt, **tracker_kwargs)
+
+    errors = []
+    ious = []
+    boxes = []
+    failures = 0
+    elapsed = 0.0
+    for frame, gt in clip:
+        start = time.perf_counter()
+        success, bbox = tracker.update(frame)
+        elapsed += time.perf_counter() - start
+
+        boxes.append(bbox if success else None)
+        # A lost frame counts as zero overlap
+        ious.append(iou(bbox, gt) if success else 0.0)
+        if success:
+            errors.append(center_error(bbox, gt))
+        else:
+            failures += 1
+
+    errors = np.asarray(errors) if errors else np.array([np.nan])
+    return {
+        "fps": (num_frames - 1) / elapsed,
+        "mean_error": float(np.mean(errors)),
+        "max_error": float(np.max(errors)),
+        "mean_iou": float(np.mean(ious)),
+        "failures": failures,
+        "boxes": boxes,
+        "backend": tracker.backend,
+    }
+
+
+def bench_proxy_scale(args):
+    width = args.height * 16 // 9
+    print(f"Proxy-scale tracking, {width}x{args.height}, {args.frames} frames")
+    print(f"{'scale':>6} {'fps':>8} {'speedup':>8} {'mean err px':>12} {'max err px':>11} {'failures':>9}")
+
+    baseline_fps = None
+    for scale in args.scales:
+        result = run_tracker(width, args.height, args.frames, scale=scale)
+        baseline_fps = baseline_fps or result["fps"]
+        print(f"{scale:>6.2f} {result['fps']:>8.1f} {result['fps'] / baseline_fps:>7.2f}x "
+              f"{result['mean_error']:>12.1f} {result['max_error']:>11.1f} {result['failures']:>9}")
+
+
+def bench_stride(args):
+    width = args.height * 16 // 9
+    print(f"Keyframe-stride tracking, {width}x{args.height}, {args.frames} frames, proxy scale {args.scale}")
+    print(f"{'backend':>8} {'stride':>6} {'fps':>8} {'speedup':>8} {'mean IoU':>9} {'mean err px':>12} "
+          f"{'vs stride 1 px':>15} {'failures':>9}")
+
+    for backend in args.backends:
+        baseline = None
+        for stride in args.strides:
+            result = run_tracker(width, args.height, args.frames, scale=args.scale, stride=stride, backend=backend)
+            baseline = baseline or result
+            # Position error against plain per-frame tracking, on frames both tracked
+            deviations = [center_error(box, ref) for box, ref in zip(result["boxes"], baseline["boxes"])
+                          if box is not None and ref is not None]
+            deviation = float(np.mean(deviations)) if deviations else float("nan")
+            print(f"{backend:>8} {stride:>6} {result['fps']:>8.1f} {result['fps'] / baseline['fps']:>7.2f}x "
+                  f"{result['mean_iou']:>9.2f} {result['mean_error']:>12.1f} {deviation:>15.1f} "
+                  f"{result['failures']:>9}")
+
+
+def bench_backends(args):
+    width = args.height * 16 // 9
+    print(f"Tracker backends, {width}x{args.height}, {args.frames} frames, proxy scale {args.scale}")
+    print(f"{'backend':>12} {'stride':>6} {'fps':>8} {'mean IoU':>9} {'mean err px':>12} {'failures':>9}")
+
+    for backend in args.backends:
+        for stride in args.strides:
+            result = run_tracker(width, args.height, args.frames, scale=args.scale, stride=stride, backend=backend,
+                                 target_fps=args.target_fps)
+            name = f"auto->{result['backend']}" if backend == "auto" else backend
+            print(f"{name:>12} {stride:>6} {result['fps']:>8.1f} {result['mean_iou']:>9.2f} "
+                  f"{result['mean_error']:>12.1f} {result['failures']:>9}")
+
+
+def _resize_alloc(frame, window, out):
+    # The original renderer: a freshly allocated output every frame
+    x1, y1, x2, y2 = window
+    return cv2.resize(frame[y1:y2, x1:x2], (out.shape[1], out.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+
+def _warp_affine(frame, window, out, _matrix=np.zeros((2, 3))):
+    # Crop and scale as one affine warp into out, same pixel-centre convention as cv2.resize
+    x1, y1, x2, y2 = window
+    scale_x = out.shape[1] / (x2 - x1)
+    scale_y = out.shape[0] / (y2 - y1)
+    _matrix[0, 0], _matrix[0, 2] = scale_x, scale_x * (0.5 - x1) - 0.5
+    _matrix[1, 1], _matrix[1, 2] = scale_y, scale_y * (0.5 - y1) - 0.5
+    return cv2.warpAffine(frame, _matrix, (out.shape[1], out.shape[0]), dst=out, flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def _measure_renderer(render, frames, windows, out, repeats):
+    # Warm up, then time the hot loop on its own
+    for frame, window in zip(frames, windows):
+        render(frame, window, out)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for frame, window in zip(frames, windows):
+            render(frame, window, out)
+    fps = repeats * len(frames) / (time.perf_counter() - start)
+
+    # Separate pass under tracemalloc, which slows everything down. Frame-sized
+    # allocations show up as the peak; anything kept alive would show as growth.
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for frame, window in zip(frames, windows):
+        render(frame, window, out)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return fps, peak
+
+
+def bench_crop(args):
+    width = args.height * 16 // 9
+    out_h, out_w = args.height // 2 * 2, int(args.height * 9 / 16) // 2 * 2
+    clip = list(synthetic_clip(width, args.height, args.frames))
+    frames = [frame.copy() for frame, _ in clip]
+    planner = CropPlanner(width, args.height, out_w, out_h, clip[0][1])
+    windows = [planner.next_window(True, gt) for _, gt in clip]
+    out = np.empty((out_h, out_w, 3), dtype=np.uint8)
+
+    print(f"Crop + scale, {width}x{args.height} -> {out_w}x{out_h}, {args.frames} frames x {args.repeats}")
+    print(f"{'renderer':>16} {'fps':>9} {'alloc KB/frame':>15}")
+    renderers = (("resize (alloc)", _resize_alloc), ("warpAffine", _warp_affine), ("resize into out", render_crop))
+    for name, render in renderers:
+        fps, peak = _measure_renderer(render, frames, windows, out, args.repeats)
+        print(f"{name:>16} {fps:>9.1f} {peak / 1024:>15.1f}")
+
+
+SCENARIOS = ("motion", "occlusion", "scaling")
+SUITE_HEIGHTS = (720, 1080, 2160)
+
+# process_zoom_tracking options for each mode the suite runs
+SUITE_MODES = {
+    "single": {},
+    "proxy": {"track_scale": 0.5},
+    "stride": {"track_stride": 4},
+    "two-pass": {"two_pass": True},
+}
+
+# Worst changes against the baseline that still pass: relative fps drop and
+# peak RSS growth, and absolute IoU drop
+FPS_TOLERANCE = 0.2
+RSS_TOLERANCE = 0.2
+IOU_TOLERANCE = 0.05
+
+
+def write_clip(path, width, height, num_frames, scenario, fps=30.0):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    boxes = []
+    for frame, gt in synthetic_clip(width, height, num_frames, scenario=scenario):
+        out.write(frame)
+        boxes.append(gt)
+    out.release()
+    return boxes
+
+
+def _run_suite_case(clip_path, ground_truth, mode):
+    # Runs in a fresh process, so ru_maxrss is the peak of this case alone.
+    # Imported here because the app module sets up the server on import.
+    from app import process_zoom_tracking
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        summary = process_zoom_tracking(clip_path, os.path.join(out_dir, "out.mp4"), bbox=ground_truth[0],
+                                        return_trajectory=True, **SUITE_MODES[mode])
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    # Accuracy of the boxes the pipeline itself tracked on the encoded clip, after
+    # the frame it was initialised on; a lost frame counts as zero overlap
+    boxes = summary["trajectory"][1:, 0]
+    ious = [0.0 if np.isnan(bbox).any() else iou(bbox, gt) for bbox, gt in zip(boxes, ground_truth[1:])]
+    return {
+        "fps": summary["fps"],
+        "peak_rss_mb": peak_rss_mb,
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+        "tracker_failures": summary["tracker_failures"],
+    }
+
+
+def compare_to_baseline(results, baseline):
+    """Return a description of every result that regressed past the tolerances."""
+    regressions = []
+    for key, result in results.items():
+        ref = baseline.get(key)
+        if ref is None:
+            continue
+        if result["fps"] < ref["fps"] * (1 - FPS_TOLERANCE):
+            regressions.append(f"{key}: fps {ref['fps']:.1f} -> {result['fps']:.1f}")
+        if result["peak_rss_mb"] > ref["peak_rss_mb"] * (1 + RSS_TOLERANCE):
+            regressions.append(f"{key}: peak RSS {ref['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB")
+        if result["mean_iou"] < ref["mean_iou"] - IOU_TOLERANCE:
+            regressions.append(f"{key}: IoU {ref['mean_iou']:.2f} -> {result['mean_iou']:.2f}")
+    return regressions
+
+
+def bench_suite(args):
+    print(f"Pipeline suite, {args.frames} frames per clip")
+    print(f"{'case':>24} {'fps':>8} {'peak RSS MB':>12} {'mean IoU':>9} {'failures':>9}")
+
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as clip_dir:
+        for height in args.heights:
+            width = height * 16 // 9
+            for scenario in args.scenarios:
+                clip_path = os.path.join(clip_dir, f"{scenario}_{height}.mp4")
+                ground_truth = write_clip(clip_path, width, height, args.frames, scenario)
+                for mode in args.modes:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                        result = pool.submit(_run_suite_case, clip_path, ground_truth, mode).result()
+                    key = f"{scenario}/{height}p/{mode}"
+                    results[key] = result
+                    print(f"{key:>24} {result['fps']:>8.1f} {result['peak_rss_mb']:>12.0f} "
+                          f"{result['mean_iou']:>9.2f} {result['tracker_failures']:>9}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    proxy = subparsers.add_parser("proxy-scale", help="tracker fps and drift vs. proxy scale")
+    proxy.add_argument("--height", type=int, default=1080)
+    proxy.add_argument("--frames", type=int, default=150)
+    proxy.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.33, 0.25])
+    proxy.set_defaults(func=bench_proxy_scale)
+
+    stride = subparsers.add_parser("stride", help="tracker fps and error vs. keyframe stride")
+    stride.add_argument("--height", type=int, default=1080)
+    stride.add_argument("--frames", type=int, default=150)
+    stride.add_argument("--scale", type=float, default=1.0)
+    stride.add_argument("--strides", type=int, nargs="+", default=[1, 2, 3, 5, 8])
+    stride.add_argument("--backends", nargs="+", default=list(TRACKER_BACKENDS), choices=list(TRACKER_BACKENDS))
+    stride.set_defaults(func=bench_stride)
+
+    backends = subparsers.add_parser("backends", help="tracker fps and IoU per backend")
+    backends.add_argument("--height", type=int, default=720)
+    backends.add_argument("--frames", type=int, default=150)
+    backends.add_argument("--scale", type=float, default=1.0)
+    backends.add_argument("--backends", nargs="+", default=[*TRACKER_BACKENDS, "auto"])
+    backends.add_argument("--target-fps", type=float, default=30.0, help="fps budget for auto mode")
+    backends.add_argument("--strides", type=int, nargs="+", default=[1, 4],
+                          help="keyframe strides; only CSRT (and auto while on it) uses them")
+    backends.set_defaults(func=bench_backends)
+
+    crop = subparsers.add_parser("crop", help="crop/scale renderer fps and per-frame allocations")
+    crop.add_argument("--height", type=int, default=1080)
+    crop.add_argument("--frames", type=int, default=30)
+    crop.add_argument("--repeats", type=int, default=10)
+    crop.set_defaults(func=bench_crop)
+
+    suite = subparsers.add_parser("suite", help="full pipeline fps, peak RSS and IoU per scenario, size and mode")
+    suite.add_argument("--frames", type=int, default=90)
+    suite.add_argument("--heights", type=int, nargs="+", default=list(SUITE_HEIGHTS))
+    suite.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    suite.add_argument("--modes", nargs="+", choices=list(SUITE_MODES), default=list(SUITE_MODES))
+    suite.add_argument("--baseline", help="JSON results to compare against; exits 1 on a regression")
+    suite.add_argument("--save-baseline", help="write the results as a new baseline JSON file")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import Counter
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ResultCache:
+    """Content-addressed storage for uploads and their processed outputs.
+
+    Uploads are stored as <sha256 of the bytes>.mp4, so re-uploading a clip reuses
+    one file. Outputs are named after a key that hashes the upload together with
+    the processing parameters, and a <key>.done marker is written once all of them
+    are complete. Both directories together are kept under max_bytes by evicting
+    the least recently used entries that no running job needs.
+    """
+
+    def __init__(self, upload_dir, output_dir, max_bytes):
+        self.upload_dir = upload_dir
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Upload and output entries in use by queued or running jobs
+        self._pinned = Counter()
+
+    def save_upload(self, src):
+        """Copy the file object src into the upload dir, hashing it on the way.
+
+        Returns (content_hash, path). The upload is pinned as it's put in place, so
+        it can't be evicted before a job pins it; release it with unpin_upload().
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=self.upload_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while chunk := src.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+            content_hash = digest.hexdigest()
+            path = os.path.join(self.upload_dir, f"{content_hash}.mp4")
+            # Under the lock, so evict() can't remove an existing copy between the check and the pin
+            with self._lock:
+                self._pinned[os.path.basename(path)] += 1
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                    self._touch(path)
+                else:
+                    os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return content_hash, path
+
+    def result_key(self, content_hash, params):
+        # Anything that changes the output has to be part of params
+        payload = json.dumps({"input": content_hash, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def output_prefix(self, key):
+        return os.path.join(self.output_dir, key)
+
+    def lookup(self, key, output_paths):
+        # True if a previous job already produced every output for key
+        marker = self._marker(key)
+        if not os.path.exists(marker) or not all(os.path.exists(path) for path in output_paths):
+            return False
+        for path in [marker, *output_paths]:
+            self._touch(path)
+        return True
+
+    def pin(self, upload_path, key):
+        with self._lock:
+            self._pinned[os.path.basename(upload_path)] += 1
+            self._pinned[key] += 1
+
+    def unpin_upload(self, upload_path):
+        with self._lock:
+            self._pinned -= Counter({os.path.basename(upload_path): 1})
+
+    def finish(self, upload_path, key, output_paths, success):
+        """Unpin a job's entries once it's done and record or discard its outputs."""
+        if success:
+            with open(self._marker(key), "w"):
+                pass
+        else:
+            # Half-written outputs must never be served as a hit
+            for path in output_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        with self._lock:
+            self._pinned -= Counter({os.path.basename(upload_path): 1, key: 1})
+        self.evict()
+
+    def touch_result(self, path):
+        self._touch(path)
+
+    def evict(self):
+        """Delete least recently used entries until both directories fit in max_bytes."""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, _, size, _ in entries.values())
+            # Outputs without a marker are leftovers of a crash; they go first
+            for name, (last_used, paths, size, complete) in sorted(
+                    entries.items(), key=lambda item: (item[1][3], item[1][0])):
+                if total <= self.max_bytes:
+                    break
+                if self._pinned[name]:
+                    continue
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+
+    def _entries(self):
+        # name -> (last used, paths, total size, complete); an output entry is every file of one key
+        entries = {}
+        for directory in (self.upload_dir, self.output_dir):
+            for item in os.scandir(directory):
+                if not item.is_file() or item.name.startswith("."):
+                    continue
+                name = item.name if directory == self.upload_dir else item.name.split("_")[0].split(".")[0]
+                stat = item.stat()
+                last_used, paths, size, complete = entries.get(name, (0.0, [], 0, directory == self.upload_dir))
+                entries[name] = (max(last_used, stat.st_mtime), paths + [item.path], size + stat.st_size,
+                                 complete or item.name.endswith(".done"))
+        return entries
+
+    def _marker(self, key):
+        return f"{self.output_prefix(key)}.done"
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
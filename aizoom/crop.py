@@ -0,0 +1,122 @@
+import cv2
+import numpy as np
+
+# Width (in frames) of the Gaussian used to smooth a two-pass crop path
+SMOOTH_SIGMA = 5.0
+
+# (aspect_w, aspect_h, zoom_factor) of the default vertical output
+DEFAULT_FORMAT = (9, 16, 1.4)
+
+
+def output_size(frame_w, frame_h, aspect_w, aspect_h):
+    # Largest size with the requested aspect ratio that fits the source; H.264 needs even dimensions
+    out_h = frame_h
+    out_w = frame_h * aspect_w / aspect_h
+    if out_w > frame_w:
+        out_w = frame_w
+        out_h = frame_w * aspect_h / aspect_w
+    return int(out_w) // 2 * 2, int(out_h) // 2 * 2
+
+
+def window_size(frame_w, frame_h, zoomed_w, zoomed_h, zoom_factor):
+    # Crop window with the output's aspect ratio, shrunk to fit the frame if needed
+    win_w = zoomed_w / zoom_factor
+    win_h = zoomed_h / zoom_factor
+    fit = min(1.0, frame_w / win_w, frame_h / win_h)
+    return int(win_w * fit), int(win_h * fit)
+
+
+class CropPlanner:
+    """Turns per-frame tracker output into a smoothed crop window.
+
+    The window keeps a fixed size and is slid back inside the frame at the
+    borders, so the output aspect ratio never changes.
+    """
+
+    def __init__(self, frame_w, frame_h, zoomed_w, zoomed_h, bbox, zoom_factor=1.4):
+        self.frame_w = frame_w
+        self.frame_h = frame_h
+        self.win_w, self.win_h = window_size(frame_w, frame_h, zoomed_w, zoomed_h, zoom_factor)
+        self.smooth_x, self.smooth_y = bbox[0], bbox[1]
+
+    def next_window(self, success, bbox):
+        if success:
+            x, y, w, h = [int(v) for v in bbox]
+            self.smooth_x = int(0.8 * self.smooth_x + 0.2 * x)
+            self.smooth_y = int(0.8 * self.smooth_y + 0.2 * y)
+            obj_center_x = self.smooth_x + w // 2
+            obj_center_y = self.smooth_y + h // 2
+        else:
+            obj_center_x = self.frame_w // 2
+            obj_center_y = self.frame_h // 2
+            self.smooth_x = int(0.9 * self.smooth_x + 0.1 * obj_center_x)
+            self.smooth_y = int(0.9 * self.smooth_y + 0.1 * obj_center_y)
+
+        x1 = min(max(0, obj_center_x - self.win_w // 2), self.frame_w - self.win_w)
+        y1 = min(max(0, obj_center_y - self.win_h // 2), self.frame_h - self.win_h)
+        return x1, y1, x1 + self.win_w, y1 + self.win_h
+
+
+def smooth_path(values, sigma=SMOOTH_SIGMA):
+    """Zero-phase Gaussian smoothing of a 1-D trajectory; NaN gaps are interpolated first."""
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return values
+    idx = np.arange(len(values))
+    values = np.interp(idx, idx[valid], values[valid])
+
+    if sigma <= 0 or len(values) < 2:
+        return values
+    radius = int(3 * sigma)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    kernel /= kernel.sum()
+    # Symmetric kernel over edge-padded data, so no lag and no pull towards zero at the ends
+    return np.convolve(np.pad(values, radius, mode="edge"), kernel, mode="valid")
+
+
+def plan_crop_path(trajectory, frame_w, frame_h, zoomed_w, zoomed_h, zoom_factor=1.4, sigma=SMOOTH_SIGMA):
+    """Turn a recorded (N, 4) bbox trajectory into an (N, 4) array of crop windows.
+
+    Rows where tracking failed are NaN; they are bridged by interpolation, and a
+    clip where the subject was never found stays centred.
+    """
+    trajectory = np.asarray(trajectory, dtype=np.float64).reshape(-1, 4)
+    centers_x = smooth_path(trajectory[:, 0] + trajectory[:, 2] / 2, sigma)
+    centers_y = smooth_path(trajectory[:, 1] + trajectory[:, 3] / 2, sigma)
+    centers_x = np.nan_to_num(centers_x, nan=frame_w / 2)
+    centers_y = np.nan_to_num(centers_y, nan=frame_h / 2)
+
+    win_w, win_h = window_size(frame_w, frame_h, zoomed_w, zoomed_h, zoom_factor)
+    x1 = np.clip(np.rint(centers_x - win_w / 2), 0, frame_w - win_w).astype(np.int64)
+    y1 = np.clip(np.rint(centers_y - win_h / 2), 0, frame_h - win_h).astype(np.int64)
+    return np.stack([x1, y1, x1 + win_w, y1 + win_h], axis=1)
+
+
+def tile_bounds(out_h, count):
+    # Row ranges of count split-screen tiles stacked top to bottom
+    edges = [out_h * i // count for i in range(count + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def render_tiles(frame, windows, out):
+    """Render one crop window per tile, stacked top to bottom in out.
+
+    A single window fills the whole output. Row bands of out are contiguous
+    views, so each tile is still resized straight into the output buffer.
+    """
+    for window, (y0, y1) in zip(windows, tile_bounds(out.shape[0], len(windows))):
+        render_crop(frame, window, out[y0:y1])
+    return out
+
+
+def render_crop(frame, window, out):
+    """Scale the crop window into the preallocated output frame.
+
+    The window is a view into the decoded frame and cv2.resize writes straight
+    into out, so nothing is allocated per frame. A single cv2.warpAffine would
+    also avoid the copy but runs ~5x slower per core (see benchmark.py crop).
+    """
+    x1, y1, x2, y2 = window
+    cv2.resize(frame[y1:y2, x1:x2], (out.shape[1], out.shape[0]), dst=out, interpolation=cv2.INTER_LINEAR)
+    return out
@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+# Detection runs on a downscaled copy of the frame; this is the width used
+DETECT_WIDTH = 640
+
+_hog = None
+
+
+def _get_hog():
+    global _hog
+    if _hog is None:
+        _hog = cv2.HOGDescriptor()
+        _hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    return _hog
+
+
+def _detect_people(small):
+    rects, weights = _get_hog().detectMultiScale(small, winStride=(8, 8), padding=(8, 8), scale=1.05)
+    # Most confident people first
+    order = np.argsort(-np.asarray(weights).ravel())
+    return [tuple(int(v) for v in rects[i]) for i in order]
+
+
+def _detect_salient(small):
+    # Spectral residual saliency lives in opencv-contrib
+    if not hasattr(cv2, "saliency"):
+        return None
+    saliency = cv2.saliency.StaticSaliencySpectralResidual_create()
+    ok, saliency_map = saliency.computeSaliency(small)
+    if not ok:
+        return None
+
+    saliency_map = (saliency_map * 255).astype(np.uint8)
+    _, mask = cv2.threshold(saliency_map, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    return cv2.boundingRect(max(contours, key=cv2.contourArea))
+
+
+def detect_subjects(frame, max_count=1):
+    """Find up to max_count people (or failing that the most salient region) in frame.
+
+    Returns a list of (x, y, w, h) boxes in frame coordinates, most confident
+    first; empty if nothing was found.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    scale = min(1.0, DETECT_WIDTH / frame_w)
+    small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+
+    boxes = _detect_people(small)[:max_count]
+    if not boxes:
+        salient = _detect_salient(small)
+        boxes = [salient] if salient is not None else []
+
+    boxes = [tuple(int(round(v / scale)) for v in bbox) for bbox in boxes]
+    return [bbox for bbox in boxes if bbox[2] > 0 and bbox[3] > 0]
+
+
+def center_box(frame):
+    # Fallback when nothing is detected: the middle third of the frame
+    frame_h, frame_w = frame.shape[:2]
+    return (frame_w // 3, frame_h // 3, frame_w // 3, frame_h // 3)
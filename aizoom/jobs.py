@@ -0,0 +1,124 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobQueue:
+    """Runs video jobs in a bounded process pool so the event loop never blocks.
+
+    Finished jobs are forgotten after job_ttl seconds, or sooner, oldest first,
+    once more than max_finished of them are kept.
+    """
+
+    def __init__(self, max_workers, max_pending, job_ttl=24 * 3600, max_finished=1000):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+        # Finished job ids in the order they finished, with the time they did
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._executor = None
+
+    def _get_executor(self):
+        # Started lazily so importing the app (e.g. in a pool worker) doesn't fork
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, fn, *args, output_paths=(), **kwargs):
+        with self._lock:
+            # Jobs waiting or running; anything past the limit is rejected
+            if self._active >= self.max_workers + self.max_pending:
+                raise QueueFullError("Job queue is full")
+            try:
+                future = self._get_executor().submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory) and took the pool with it; start a new one
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                future = self._get_executor().submit(fn, *args, **kwargs)
+            # Counted only once submitted, so a failed submit leaves no slot taken
+            self._active += 1
+            job_id = self._add(future, output_paths)
+
+        future.add_done_callback(lambda future: self._job_done(job_id))
+        return job_id
+
+    def add_finished(self, output_paths=(), result=None):
+        # A job whose outputs already exist, e.g. a cache hit; it never takes a worker
+        future = Future()
+        future.set_result(result)
+        with self._lock:
+            job_id = self._add(future, output_paths)
+            self._finished[job_id] = time.time()
+        return job_id
+
+    def _add(self, future, output_paths):
+        # Called with the lock held
+        self._expire()
+        job_id = str(uuid.uuid4())
+        self.jobs[job_id] = {
+            "id": job_id,
+            "future": future,
+            "output_paths": list(output_paths),
+            "created_at": time.time(),
+        }
+        return job_id
+
+    def _expire(self):
+        # Called with the lock held; finished jobs leave in the order they finished
+        cutoff = time.time() - self.job_ttl
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if finished_at >= cutoff and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[job_id]
+            self.jobs.pop(job_id, None)
+
+    def get(self, job_id):
+        """The job's entry, or None if there's no such job or it has expired."""
+        with self._lock:
+            self._expire()
+            return self.jobs.get(job_id)
+
+    @property
+    def active(self):
+        # Jobs queued or running
+        return self._active
+
+    def _job_done(self, job_id):
+        with self._lock:
+            self._active -= 1
+            self._finished[job_id] = time.time()
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        future = job["future"]
+        if not future.done():
+            status = "processing" if future.running() else "queued"
+        elif future.cancelled() or future.exception() is not None:
+            status = "failed"
+        else:
+            status = "complete"
+
+        info = {"job_id": job_id, "status": status, "created_at": job["created_at"]}
+        if status == "failed" and not future.cancelled():
+            info["error"] = str(future.exception())
+        return info
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,203 @@
+"""Vertical re-framing of a live stream with a per-frame latency budget.
+
+Reads an RTSP/UDP/HTTP source (anything OpenCV's ffmpeg backend opens), tracks
+the subject, crops every frame and re-emits it through ffmpeg. Usage:
+
+    python live.py udp://127.0.0.1:5000 udp://127.0.0.1:5001 --budget-ms 100
+
+A local stand-in for a live source:
+
+    ffmpeg -re -i clip.mp4 -c:v libx264 -tune zerolatency -f mpegts udp://127.0.0.1:5000
+"""
+import argparse
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from crop import DEFAULT_FORMAT, CropPlanner, output_size, render_crop
+from detector import center_box, detect_subjects
+from tracking import SubjectTracker
+from writers import FFmpegLiveWriter
+
+# Latency budget per frame, from capture to hand-off to the encoder
+LATENCY_BUDGET_MS = 100.0
+
+# Latencies kept for the percentiles, and how often they are printed
+LATENCY_WINDOW = 1000
+REPORT_SECONDS = 10.0
+
+# Stage costs are estimated by a decaying peak, so a frame is only started when
+# even a recent slow run of each stage would fit; each frame the peak decays by this factor
+COST_DECAY = 0.9
+
+
+class LatestFrame:
+    """Reads the source on its own thread and keeps only the newest frame.
+
+    A slow consumer never builds a backlog: any frame not taken before the
+    next one arrives is dropped and counted. The capture is released by the
+    reader thread once the source ends or close() is called.
+    """
+
+    def __init__(self, cap):
+        self._cap = cap
+        self._cond = threading.Condition()
+        self._frame = None
+        self.ended = False
+        self._closed = False
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        while True:
+            ret, frame = self._cap.read()
+            captured_at = time.perf_counter()
+            with self._cond:
+                if not ret or self._closed:
+                    self.ended = True
+                    self._cond.notify()
+                    break
+                if self._frame is not None:
+                    self.dropped += 1
+                self._frame = (frame, captured_at)
+                self._cond.notify()
+        self._cap.release()
+
+    def close(self, timeout=5.0):
+        # The reader stops after its current read; a stalled source may not return in time
+        with self._cond:
+            self._closed = True
+        self._thread.join(timeout)
+
+    def get(self, timeout=None):
+        # Returns (frame, captured_at), or None if the source has ended or nothing arrived in time
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self.ended, timeout)
+            item, self._frame = self._frame, None
+            return item
+
+
+def latency_percentiles(latencies):
+    if not latencies:
+        return {}
+    p50, p90, p99 = np.percentile(np.asarray(latencies), [50, 90, 99])
+    return {"p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99), "max_ms": float(max(latencies))}
+
+
+def process_live_stream(source, output, bbox=None, budget_ms=LATENCY_BUDGET_MS, aspect=DEFAULT_FORMAT[:2],
+                        zoom_factor=DEFAULT_FORMAT[2], track_scale=1.0, tracker_backend="kcf",
+                        container="mpegts", duration=None):
+    """Track, crop and re-encode source into output until the source ends (or duration seconds).
+
+    Each frame should reach the encoder within budget_ms of being captured. A
+    frame whose rendering and encoding wouldn't fit in what's left of the budget
+    is dropped. When a tracker update wouldn't fit as well, the update is skipped
+    and the crop holds the last box. Returns frame counts and capture-to-encoder
+    latency percentiles in milliseconds.
+    """
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open stream {source}.")
+
+    ret, frame = cap.read()
+    if not ret:
+        raise RuntimeError("Couldn't read the first frame.")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_h, frame_w = frame.shape[:2]
+    zoomed_w, zoomed_h = output_size(frame_w, frame_h, *aspect)
+    if bbox is None:
+        boxes = detect_subjects(frame)
+        bbox = boxes[0] if boxes else center_box(frame)
+
+    tracker = SubjectTracker(frame, bbox, scale=track_scale, backend=tracker_backend, target_fps=fps)
+    planner = CropPlanner(frame_w, frame_h, zoomed_w, zoomed_h, bbox, zoom_factor)
+    out = np.empty((zoomed_h, zoomed_w, 3), dtype=np.uint8)
+    writer = FFmpegLiveWriter(output, zoomed_w, zoomed_h, fps, container=container)
+
+    budget = budget_ms / 1000.0
+    # Cost of one tracker update and of rendering plus encoding a frame, to
+    # predict whether the work left for a frame still fits in its budget
+    track_cost = output_cost = 0.0
+    latencies = deque(maxlen=LATENCY_WINDOW)
+    stats = {"frames": 0, "late_drops": 0, "skipped_updates": 0, "tracker_failures": 0}
+    frames = LatestFrame(cap)
+    started = last_report = time.perf_counter()
+    try:
+        while duration is None or time.perf_counter() - started < duration:
+            item = frames.get(timeout=1.0)
+            if item is None:
+                if frames.ended:
+                    break
+                # Source stalled; keep waiting until it resumes or duration runs out
+                continue
+            frame, captured_at = item
+            start = time.perf_counter()
+            age = start - captured_at
+            if age + output_cost > budget:
+                stats["late_drops"] += 1
+                continue
+
+            if age + track_cost + output_cost <= budget:
+                success, bbox = tracker.update(frame)
+                track_cost = max(time.perf_counter() - start, track_cost * COST_DECAY)
+                if not success:
+                    stats["tracker_failures"] += 1
+            else:
+                # Hold the last box; the decay lets tracking be retried once there's headroom
+                success, bbox = True, tracker.last_bbox
+                track_cost *= COST_DECAY
+                stats["skipped_updates"] += 1
+
+            output_start = time.perf_counter()
+            render_crop(frame, planner.next_window(success, bbox), out)
+            writer.write(out)
+            now = time.perf_counter()
+            output_cost = max(now - output_start, output_cost * COST_DECAY)
+            stats["frames"] += 1
+            latencies.append((now - captured_at) * 1000.0)
+
+            if now - last_report >= REPORT_SECONDS:
+                last_report = now
+                p = latency_percentiles(latencies)
+                print(f"live: {stats['frames']} frames, {frames.dropped + stats['late_drops']} dropped, "
+                      f"latency p50 {p['p50_ms']:.1f} ms / p99 {p['p99_ms']:.1f} ms")
+    finally:
+        frames.close()
+        writer.release()
+
+    elapsed = time.perf_counter() - started
+    stats["superseded_drops"] = frames.dropped
+    stats["fps"] = stats["frames"] / elapsed if elapsed > 0 else 0.0
+    stats.update(latency_percentiles(latencies))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="input stream URL or device")
+    parser.add_argument("output", help="output URL (or file) for the vertical stream")
+    parser.add_argument("--budget-ms", type=float, default=LATENCY_BUDGET_MS)
+    parser.add_argument("--bbox", type=int, nargs=4, metavar=("X", "Y", "W", "H"))
+    parser.add_argument("--aspect", default="9:16")
+    parser.add_argument("--zoom", type=float, default=DEFAULT_FORMAT[2])
+    parser.add_argument("--track-scale", type=float, default=1.0)
+    parser.add_argument("--tracker", default="kcf")
+    parser.add_argument("--container", default="mpegts", help="ffmpeg output format, e.g. mpegts or flv")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    args = parser.parse_args()
+
+    aspect = tuple(int(v) for v in args.aspect.split(":"))
+    stats = process_live_stream(args.source, args.output, bbox=args.bbox, budget_ms=args.budget_ms,
+                                aspect=aspect, zoom_factor=args.zoom, track_scale=args.track_scale,
+                                tracker_backend=args.tracker, container=args.container, duration=args.duration)
+    for name, value in stats.items():
+        print(f"{name:>18}: {value:.1f}" if isinstance(value, float) else f"{name:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
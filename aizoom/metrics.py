@@ -0,0 +1,160 @@
+import threading
+import time
+
+# Upper bounds (seconds) of the per-frame stage histograms
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Upper bounds of the per-job frames/sec histogram
+FPS_BUCKETS = (1, 2.5, 5, 10, 15, 24, 30, 60, 120)
+
+
+class Histogram:
+    """Counts per bucket plus sum and count, mergeable across processes as plain dicts."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, data):
+        for i, n in enumerate(data["counts"]):
+            self.counts[i] += n
+        self.sum += data["sum"]
+        self.count += data["count"]
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+class StageTimer:
+    """Per-job timings: one histogram of seconds per frame for each pipeline stage.
+
+    Stages run on different threads (and several writers share "write"), so
+    observations are taken under a lock.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram(STAGE_BUCKETS)
+            self.histograms[stage].observe(seconds)
+
+    def summary(self):
+        # Plain dicts, so the summary can travel back from a worker process and be saved as JSON
+        with self._lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                stages[stage] = histogram.to_dict()
+                stages[stage]["mean_ms"] = 1000.0 * histogram.sum / histogram.count if histogram.count else 0.0
+            return stages
+
+
+def timed(timer, stage, fn):
+    # fn wrapped to record each call's duration under stage; fn itself if there's no timer
+    if timer is None:
+        return fn
+
+    def wrapper(*args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timer.observe(stage, time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def combine_summaries(summaries, seconds):
+    """One job summary from several partial ones (e.g. segments processed in parallel) taking seconds overall."""
+    stages = {}
+    for summary in summaries:
+        for stage, data in summary["stages"].items():
+            stages.setdefault(stage, Histogram(data["buckets"])).merge(data)
+    frames = sum(summary["frames"] for summary in summaries)
+    combined = {
+        "frames": frames,
+        "seconds": seconds,
+        "fps": frames / seconds if seconds > 0 else 0.0,
+        "tracker_failures": sum(summary["tracker_failures"] for summary in summaries),
+        "tracker_backends": sorted({b for summary in summaries for b in summary["tracker_backends"]}),
+        "stages": {},
+    }
+    for stage, histogram in stages.items():
+        combined["stages"][stage] = histogram.to_dict()
+        combined["stages"][stage]["mean_ms"] = 1000.0 * histogram.sum / histogram.count if histogram.count else 0.0
+    return combined
+
+
+class MetricsRegistry:
+    """Server-wide totals built from finished job summaries, rendered for Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.job_fps = Histogram(FPS_BUCKETS)
+        self.jobs = {"complete": 0, "failed": 0}
+        self.frames = 0
+        self.tracker_failures = 0
+
+    def record_job(self, summary):
+        with self._lock:
+            self.jobs["complete"] += 1
+            self.frames += summary["frames"]
+            self.tracker_failures += summary["tracker_failures"]
+            if summary["fps"] > 0:
+                self.job_fps.observe(summary["fps"])
+            for stage, data in summary["stages"].items():
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram(STAGE_BUCKETS)
+                self.stages[stage].merge(data)
+
+    def record_failure(self):
+        with self._lock:
+            self.jobs["failed"] += 1
+
+    def render(self, gauges=None):
+        """Prometheus text exposition format. gauges maps metric name to a current value."""
+        lines = []
+        with self._lock:
+            lines += ["# HELP aizoom_stage_seconds Time per frame spent in each pipeline stage.",
+                      "# TYPE aizoom_stage_seconds histogram"]
+            for stage, histogram in sorted(self.stages.items()):
+                lines += _histogram_lines("aizoom_stage_seconds", histogram, f'stage="{stage}",')
+            lines += ["# HELP aizoom_job_fps Frames per second of each finished job.",
+                      "# TYPE aizoom_job_fps histogram"]
+            lines += _histogram_lines("aizoom_job_fps", self.job_fps)
+            lines += ["# HELP aizoom_jobs_total Jobs finished, by outcome.", "# TYPE aizoom_jobs_total counter"]
+            lines += [f'aizoom_jobs_total{{status="{status}"}} {n}' for status, n in self.jobs.items()]
+            lines += ["# HELP aizoom_frames_total Frames processed by finished jobs.",
+                      "# TYPE aizoom_frames_total counter", f"aizoom_frames_total {self.frames}",
+                      "# HELP aizoom_tracker_failures_total Frames on which a subject's tracker failed.",
+                      "# TYPE aizoom_tracker_failures_total counter",
+                      f"aizoom_tracker_failures_total {self.tracker_failures}"]
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name, histogram, labels=""):
+    # Prometheus buckets are cumulative
+    lines = []
+    total = 0
+    for bound, n in zip(histogram.buckets, histogram.counts):
+        total += n
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {total}')
+    lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+    label_set = f"{{{labels.rstrip(',')}}}" if labels else ""
+    lines.append(f"{name}_sum{label_set} {histogram.sum}")
+    lines.append(f"{name}_count{label_set} {histogram.count}")
+    return lines
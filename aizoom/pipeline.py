@@ -0,0 +1,141 @@
+import queue
+import threading
+
+import numpy as np
+
+from metrics import timed
+
+# Frames in flight between two stages; a couple are enough to keep every stage busy
+QUEUE_SIZE = 3
+# Most bytes of source frames preallocated for one video; larger frames get shallower queues
+FRAME_BUFFER_BYTES = 192 * 1024 * 1024
+
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class BufferPool:
+    """Fixed set of preallocated frames handed out and returned by the stages."""
+
+    def __init__(self, shape, count, dtype=np.uint8):
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(np.empty(shape, dtype=dtype))
+
+    def acquire(self, stop):
+        return _get(self._free, stop)
+
+    def release(self, buf):
+        self._free.put(buf)
+
+
+def _put(q, item, stop):
+    # Blocking put that gives up once another stage has failed
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+    raise PipelineAborted()
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    raise PipelineAborted()
+
+
+def run_pipeline(cap, frame_shape, track, render, outputs, first_frame=None, queue_size=QUEUE_SIZE,
+                 timer=None, track_stage="track"):
+    """Decode, track, render and write frames on separate threads joined by bounded queues.
+
+    outputs is a list of (out_shape, write) pairs. track(frame) runs strictly in
+    frame order and returns one plan per output; render(frame, plan, out) fills a
+    preallocated output frame and each output's write(out) runs on its own thread,
+    so several encodes share a single decode and tracking pass. OpenCV releases
+    the GIL while decoding, resizing and encoding, so the stages overlap across cores.
+    first_frame, if given, is an already-decoded frame processed before the rest of cap.
+    With a metrics.StageTimer, every decode, track, render and write call is timed;
+    track calls are recorded under track_stage.
+    queue_size is lowered for large frames so the source frames stay within
+    FRAME_BUFFER_BYTES (depth 2 at 4K).
+    """
+    stop = threading.Event()
+    errors = []
+
+    frame_bytes = int(np.prod(frame_shape))
+    queue_size = max(1, min(queue_size, (FRAME_BUFFER_BYTES // frame_bytes - 3) // 2))
+    # Each pool covers every queue slot plus one frame being worked on per stage
+    frames = BufferPool(frame_shape, 2 * queue_size + 3)
+    output_pools = [BufferPool(out_shape, queue_size + 2) for out_shape, _ in outputs]
+
+    track_q = queue.Queue(queue_size)
+    render_q = queue.Queue(queue_size)
+    write_qs = [queue.Queue(queue_size) for _ in outputs]
+
+    read = timed(timer, "decode", cap.read)
+    track = timed(timer, track_stage, track)
+    render = timed(timer, "render", render)
+
+    def decode():
+        if first_frame is not None:
+            buf = frames.acquire(stop)
+            np.copyto(buf, first_frame)
+            _put(track_q, buf, stop)
+        while True:
+            buf = frames.acquire(stop)
+            ret, frame = read(buf)
+            if not ret:
+                break
+            _put(track_q, frame, stop)
+
+    def track_stage():
+        while (frame := _get(track_q, stop)) is not _DONE:
+            _put(render_q, (frame, track(frame)), stop)
+
+    def render_stage():
+        while (item := _get(render_q, stop)) is not _DONE:
+            frame, plans = item
+            for plan, pool, write_q in zip(plans, output_pools, write_qs):
+                _put(write_q, render(frame, plan, pool.acquire(stop)), stop)
+            frames.release(frame)
+
+    def write_stage(write, pool, write_q):
+        write = timed(timer, "write", write)
+        while (out := _get(write_q, stop)) is not _DONE:
+            write(out)
+            pool.release(out)
+
+    def run(stage, downstream, *args):
+        try:
+            stage(*args)
+            for q in downstream:
+                _put(q, _DONE, stop)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [
+        threading.Thread(target=run, args=(decode, [track_q]), daemon=True),
+        threading.Thread(target=run, args=(track_stage, [render_q]), daemon=True),
+        threading.Thread(target=run, args=(render_stage, write_qs), daemon=True),
+    ]
+    for (_, write), pool, write_q in zip(outputs, output_pools, write_qs):
+        threads.append(threading.Thread(target=run, args=(write_stage, [], write, pool, write_q), daemon=True))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
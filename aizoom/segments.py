@@ -0,0 +1,39 @@
+import glob
+import os
+import shutil
+import subprocess
+
+
+def _run_ffmpeg(args):
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("Segment-parallel processing needs ffmpeg on PATH.")
+    result = subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *args], capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+def split_at_keyframes(input_video_path, segment_dir, segment_seconds):
+    """Cut the input into pieces of roughly segment_seconds without re-encoding.
+
+    The segment muxer only cuts on keyframes, so every piece decodes on its own.
+    Returns the segment paths in playback order.
+    """
+    pattern = os.path.join(segment_dir, "segment_%04d.mp4")
+    _run_ffmpeg([
+        "-i", input_video_path, "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+        "-f", "segment", "-segment_time", f"{segment_seconds:.3f}", "-reset_timestamps", "1", pattern,
+    ])
+    return sorted(glob.glob(os.path.join(segment_dir, "segment_*.mp4")))
+
+
+def concat_segments(segment_paths, output_video_path):
+    # Concat demuxer with stream copy: the processed pieces are joined without re-encoding
+    list_path = f"{output_video_path}.txt"
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    try:
+        _run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy",
+                     "-movflags", "+faststart", output_video_path])
+    finally:
+        os.remove(list_path)
@@ -0,0 +1,244 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from detector import detect_subjects
+from metrics import timed
+
+# While the tracker is lost, re-run the detector every this many frames
+REDETECT_INTERVAL = 15
+
+# Candidates considered when re-detecting, so the nearest one can be picked
+REDETECT_CANDIDATES = 5
+
+# Optical flow between keyframes: features followed inside the box, the fewest
+# that still count as a reliable estimate, and the per-frame shift (relative to
+# the box size) beyond which we fall back to the full tracker
+FLOW_MAX_POINTS = 40
+FLOW_MIN_POINTS = 8
+FLOW_MAX_MOTION = 0.25
+
+
+# OpenCV tracker backends, selectable per request
+TRACKER_BACKENDS = {
+    "csrt": lambda: cv2.legacy.TrackerCSRT_create(),
+    "kcf": lambda: cv2.legacy.TrackerKCF_create(),
+    "mosse": lambda: cv2.legacy.TrackerMOSSE_create(),
+    "mil": lambda: cv2.legacy.TrackerMIL_create(),
+}
+
+# "auto" starts with the most robust backend and steps down this list, towards
+# faster but less accurate trackers, while it can't keep up with the fps budget
+AUTO_BACKENDS = ("csrt", "kcf", "mosse")
+
+# Backends that can run on keyframes only. CSRT searches wide enough to pick the
+# subject up after stride - 1 frames of optical flow; the others only look near
+# the box they last reported (KCF also reports it a frame late), so they lose the
+# subject on the first keyframe and run on every frame instead.
+STRIDE_BACKENDS = ("csrt",)
+
+
+def create_tracker(backend="csrt"):
+    return TRACKER_BACKENDS[backend]()
+
+
+class SubjectTracker:
+    """Tracks one subject, optionally on a downscaled proxy of each frame.
+
+    CSRT cost grows with pixel count, so with scale < 1 the tracker only sees a
+    proxy frame and boxes are mapped back to source coordinates. Boxes passed in
+    and returned are always in source-frame coordinates.
+
+    With stride > 1 the full tracker only runs on every stride-th frame; frames
+    in between move the box by the median sparse optical flow of features inside
+    it. When flow is unreliable or the motion is large, that frame falls back to
+    the full tracker. Only backends in STRIDE_BACKENDS use the stride; with the
+    others every frame runs the full tracker.
+
+    backend is a TRACKER_BACKENDS key or "auto". Auto mode times update() over
+    each window of calibration_frames frames and switches to the next faster
+    backend in AUTO_BACKENDS until the mean cost fits within 1 / target_fps.
+    """
+
+    def __init__(self, frame, bbox, scale=1.0, stride=1, backend="csrt", target_fps=30.0,
+                 calibration_frames=30):
+        self.scale = scale
+        # Stride asked for; self.stride is what the current backend actually uses
+        self.requested_stride = stride
+        self.auto = backend == "auto"
+        self.backend = AUTO_BACKENDS[0] if self.auto else backend
+        self.target_fps = target_fps
+        self.calibration_frames = max(1, calibration_frames)
+        self._calibration_time = 0.0
+        self._calibration_count = 0
+        self.lost_frames = 0
+        # Frames the tracker failed on over the whole run, for metrics
+        self.failures = 0
+        self.last_bbox = bbox
+        self._proxy = None
+        self._frame_index = 0
+        self._points = None
+        self._gray = self._prev_gray = None
+        self._init_tracker(frame, bbox)
+
+    def _to_proxy(self, frame):
+        if self.scale == 1.0:
+            return frame
+        # Resize into the same buffer every frame instead of allocating a new one
+        self._proxy = cv2.resize(frame, None, dst=self._proxy, fx=self.scale, fy=self.scale,
+                                 interpolation=cv2.INTER_AREA)
+        return self._proxy
+
+    def _init_tracker(self, frame, bbox):
+        x, y, w, h = [int(round(v * self.scale)) for v in bbox]
+        proxy = self._to_proxy(frame)
+        self.stride = self.requested_stride if self.backend in STRIDE_BACKENDS else 1
+        self.tracker = create_tracker(self.backend)
+        self.tracker.init(proxy, (x, y, max(1, w), max(1, h)))
+        if self.stride > 1:
+            self._next_gray(proxy)
+            self._seed_points((x, y, w, h))
+
+    def _next_gray(self, proxy):
+        # Two grayscale buffers, swapped every frame
+        self._prev_gray, self._gray = self._gray, self._prev_gray
+        self._gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY, dst=self._gray)
+
+    def _seed_points(self, proxy_bbox):
+        frame_h, frame_w = self._gray.shape
+        x, y, w, h = proxy_bbox
+        x1, y1 = max(0, int(x)), max(0, int(y))
+        x2, y2 = min(frame_w, int(x + w)), min(frame_h, int(y + h))
+        self._proxy_bbox = proxy_bbox
+        self._points = None
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            return
+        points = cv2.goodFeaturesToTrack(self._gray[y1:y2, x1:x2], FLOW_MAX_POINTS, 0.01, 3)
+        if points is not None:
+            self._points = points + np.array([x1, y1], dtype=np.float32)
+
+    def _flow_step(self):
+        # Shift the box by the median feature motion, or None if that isn't trustworthy
+        if self._points is None or len(self._points) < FLOW_MIN_POINTS:
+            return None
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, self._gray, self._points, None,
+                                                     winSize=(21, 21), maxLevel=3)
+        good = status.ravel() == 1
+        if good.sum() < FLOW_MIN_POINTS:
+            return None
+
+        dx, dy = np.median(points[good] - self._points[good], axis=0).ravel()
+        x, y, w, h = self._proxy_bbox
+        if np.hypot(dx, dy) > FLOW_MAX_MOTION * max(w, h):
+            return None
+        self._points = points[good]
+        self._proxy_bbox = (x + dx, y + dy, w, h)
+        return self._proxy_bbox
+
+    def update(self, frame):
+        if not self.auto:
+            return self._update(frame)
+
+        start = time.perf_counter()
+        result = self._update(frame)
+        self._calibration_time += time.perf_counter() - start
+        self._calibration_count += 1
+
+        if self._calibration_count >= self.calibration_frames:
+            too_slow = self._calibration_time / self._calibration_count > 1.0 / self.target_fps
+            next_index = AUTO_BACKENDS.index(self.backend) + 1
+            if too_slow and next_index < len(AUTO_BACKENDS):
+                # Restart on the current frame with a faster tracker and measure again;
+                # backends outside STRIDE_BACKENDS drop the stride, so it's measured without it
+                self.backend = AUTO_BACKENDS[next_index]
+                self._init_tracker(frame, self.last_bbox)
+            else:
+                self.auto = False
+            self._calibration_time = 0.0
+            self._calibration_count = 0
+        return result
+
+    def _update(self, frame):
+        proxy = self._to_proxy(frame)
+        self._frame_index += 1
+
+        if self.stride > 1:
+            self._next_gray(proxy)
+            # In-between frame while tracking is healthy: optical flow only
+            if self._frame_index % self.stride != 0 and self.lost_frames == 0:
+                bbox = self._flow_step()
+                if bbox is not None:
+                    self.last_bbox = tuple(v / self.scale for v in bbox)
+                    return True, self.last_bbox
+
+        success, bbox = self.tracker.update(proxy)
+        if success and self.stride > 1:
+            self._seed_points(bbox)
+
+        if not success:
+            # Cheap re-detection every few frames while the subject is lost
+            self.lost_frames += 1
+            self.failures += 1
+            if self.lost_frames % REDETECT_INTERVAL == 0:
+                found = self._redetect(frame)
+                if found is not None:
+                    self._init_tracker(frame, found)
+                    self.lost_frames = 0
+                    self.last_bbox = found
+                    return True, found
+            return False, None
+
+        self.lost_frames = 0
+        self.last_bbox = tuple(v / self.scale for v in bbox)
+        return True, self.last_bbox
+
+    def _redetect(self, frame):
+        # Prefer the detection closest to where the subject was last seen, so
+        # several trackers on one frame don't all jump to the same person
+        candidates = detect_subjects(frame, REDETECT_CANDIDATES)
+        if not candidates:
+            return None
+        x, y, w, h = self.last_bbox
+        return min(candidates, key=lambda c: (c[0] + c[2] / 2 - x - w / 2) ** 2 + (c[1] + c[3] / 2 - y - h / 2) ** 2)
+
+
+class MultiSubjectTracker:
+    """One SubjectTracker per subject, all updated in parallel on the same frame.
+
+    OpenCV releases the GIL inside tracker.update, so the threads really overlap.
+    update() returns a (success, bbox) pair per subject.
+    """
+
+    def __init__(self, frame, bboxes, **tracker_options):
+        self.trackers = [SubjectTracker(frame, bbox, **tracker_options) for bbox in bboxes]
+        self._pool = ThreadPoolExecutor(max_workers=len(self.trackers)) if len(self.trackers) > 1 else None
+
+    def update(self, frame):
+        if self._pool is None:
+            return [tracker.update(frame) for tracker in self.trackers]
+        return list(self._pool.map(lambda tracker: tracker.update(frame), self.trackers))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+def record_trajectory(cap, tracker, timer=None):
+    """First pass of two-pass mode: track every remaining frame, rendering nothing.
+
+    tracker is a MultiSubjectTracker. Returns an (N, subjects, 4) array of boxes
+    with NaN rows where tracking failed. Decode and tracking are timed into timer
+    (a metrics.StageTimer) if given.
+    """
+    read = timed(timer, "decode", cap.read)
+    update = timed(timer, "track", tracker.update)
+    boxes = []
+    frame = None
+    while True:
+        ret, frame = read(frame)
+        if not ret:
+            break
+        boxes.append([bbox if success else (np.nan,) * 4 for success, bbox in update(frame)])
+    return np.array(boxes, dtype=np.float64).reshape(-1, len(tracker.trackers), 4)
@@ -0,0 +1,95 @@
+import shutil
+import subprocess
+
+import cv2
+
+WRITER_BACKENDS = ("auto", "ffmpeg", "opencv")
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow")
+
+# Keyframe interval, and so fragment length, of fragmented MP4 output
+FRAGMENT_SECONDS = 1.0
+
+
+class OpenCVWriter:
+    """cv2.VideoWriter with mp4v; no audio, but needs nothing beyond OpenCV."""
+
+    def __init__(self, path, width, height, fps):
+        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+        self._out = cv2.VideoWriter(path, fourcc, fps, (width, height))
+        if not self._out.isOpened():
+            raise RuntimeError(f"Could not open {path} for writing.")
+
+    def write(self, frame):
+        self._out.write(frame)
+
+    def release(self):
+        self._out.release()
+
+
+class FFmpegWriter:
+    """Streams raw BGR frames into an ffmpeg subprocess encoding H.264.
+
+    If audio_source is given, its first audio track is muxed into the output.
+    With fragmented=True the file is written as fragmented MP4 with a keyframe
+    every FRAGMENT_SECONDS, so it can be read and played while still growing.
+    """
+
+    def __init__(self, path, width, height, fps, audio_source=None, preset="veryfast", crf=23,
+                 fragmented=False):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        ]
+        if audio_source is not None:
+            cmd += ["-i", audio_source, "-map", "0:v:0", "-map", "1:a:0?",
+                    "-c:a", "aac", "-shortest"]
+        cmd += ["-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
+        if fragmented:
+            # moov up front, a self-contained fragment per keyframe, each flushed to disk as it's done
+            cmd += ["-g", str(max(1, round(fps * FRAGMENT_SECONDS))), "-flush_packets", "1",
+                    "-movflags", "+frag_keyframe+empty_moov+default_base_moof", path]
+        else:
+            cmd += ["-movflags", "+faststart", path]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        try:
+            self._proc.stdin.write(frame.data)
+        except BrokenPipeError:
+            self.release()
+
+    def release(self):
+        if self._proc.stdin.closed:
+            return
+        self._proc.stdin.close()
+        stderr = self._proc.stderr.read().decode(errors="replace")
+        if self._proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.strip()}")
+
+
+class FFmpegLiveWriter(FFmpegWriter):
+    """Encodes raw BGR frames for a live output (UDP/RTMP/SRT URL, or a file).
+
+    Frames are timestamped by wall clock as they arrive, so dropped frames leave
+    gaps in time rather than speeding up playback. x264 runs with zerolatency,
+    which turns off lookahead and B-frames so every frame leaves the encoder at once.
+    """
+
+    def __init__(self, url, width, height, fps, container="mpegts", preset="ultrafast", crf=23):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error", "-use_wallclock_as_timestamps", "1",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-i", "-",
+            "-c:v", "libx264", "-preset", preset, "-tune", "zerolatency", "-crf", str(crf),
+            "-g", str(max(1, round(fps))), "-pix_fmt", "yuv420p", "-f", container, url,
+        ]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def open_writer(path, width, height, fps, backend="auto", **ffmpeg_options):
+    if backend == "auto":
+        backend = "ffmpeg" if shutil.which("ffmpeg") else "opencv"
+    if backend == "ffmpeg":
+        return FFmpegWriter(path, width, height, fps, **ffmpeg_options)
+    if backend == "opencv":
+        return OpenCVWriter(path, width, height, fps)
+    raise ValueError(f"Unknown writer backend: {backend}")
@@ -0,0 +1,147 @@
+"""Offline benchmarks for shortGen's scene scoring on sample clips. Usage:
+
+    python benchmark.py intensity clip1.mp4 clip2.mp4 --top-k 20
+    python benchmark.py backbones clip1.mp4 clip2.mp4
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.frame_analysis import detect_scenes
+from utils.model_registry import INTENSITY_BACKBONE, intensity_model_size, model_registry
+from utils.scene_intensity import analyze_scene_intensity, read_keyframes
+
+# Intensity models compared by the backbones benchmark; rankings are compared to the first
+BACKBONES = ('resnet50', 'resnet50+dynamic', 'resnet50+static', 'mobilenet_v3_large',
+             'mobilenet_v3_large+static', 'efficientnet_b0', 'efficientnet_b0+dynamic')
+
+
+def ranking(scores):
+    # Scene numbers, best first
+    return [item['scene'] for item in scores]
+
+
+def top_overlap(reference, other, n):
+    """Share of the reference's top n scenes that are also in other's top n."""
+    n = min(n, len(reference))
+    return len(set(reference[:n]) & set(other[:n])) / n if n else 1.0
+
+
+def spearman(reference, other):
+    """Spearman rank correlation of two rankings of the same scenes."""
+    if len(reference) < 2:
+        return 1.0
+    position = {scene: i for i, scene in enumerate(other)}
+    a = np.arange(len(reference), dtype=np.float64)
+    b = np.array([position[scene] for scene in reference], dtype=np.float64)
+    return float(np.corrcoef(a, b)[0, 1])
+
+
+def scene_times_of(video_path):
+    boundaries = detect_scenes(video_path)
+    return list(zip(boundaries[:-1].tolist(), boundaries[1:].tolist()))
+
+
+def bench_intensity(args):
+    # Load the model up front so neither scorer pays for it
+    with model_registry.use('intensity', INTENSITY_BACKBONE):
+        pass
+
+    print(f"{'video':>24} {'scenes':>6} {'full s':>7} {'cascade s':>9} {'speedup':>7} "
+          f"{'top3':>5} {'top5':>5} {'top10':>5} {'spearman':>8}")
+    for video_path in args.videos:
+        scene_times = scene_times_of(video_path)
+
+        start = time.perf_counter()
+        full = ranking(analyze_scene_intensity(video_path, scene_times, top_k=None))
+        full_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cascade = ranking(analyze_scene_intensity(video_path, scene_times, top_k=args.top_k))
+        cascade_seconds = time.perf_counter() - start
+
+        speedup = full_seconds / cascade_seconds if cascade_seconds > 0 else 0.0
+        print(f"{video_path[-24:]:>24} {len(scene_times):>6} {full_seconds:>7.2f} {cascade_seconds:>9.2f} "
+              f"{speedup:>6.1f}x {top_overlap(full, cascade, 3):>5.2f} {top_overlap(full, cascade, 5):>5.2f} "
+              f"{top_overlap(full, cascade, 10):>5.2f} {spearman(full, cascade):>8.2f}")
+
+
+def _run_backbone_case(backbone, clips):
+    # Runs in a fresh process, so load time and peak RSS belong to this backbone alone
+    start = time.perf_counter()
+    with model_registry.use('intensity', backbone):
+        pass
+    load_seconds = time.perf_counter() - start
+
+    rankings = []
+    seconds = 0.0
+    frames = 0
+    for video_path, scene_times in clips:
+        keyframes = read_keyframes(video_path, [start_time for start_time, _ in scene_times])
+        start = time.perf_counter()
+        scores = analyze_scene_intensity(video_path, scene_times, keyframes, top_k=None, backbone=backbone)
+        seconds += time.perf_counter() - start
+        frames += sum(frame is not None for frame in keyframes)
+        rankings.append(ranking(scores))
+    return {
+        'load_s': load_seconds,
+        'ms_per_frame': 1000.0 * seconds / frames if frames else 0.0,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'model_mb': intensity_model_size(backbone) / (1024 * 1024),
+        'rankings': rankings,
+    }
+
+
+def _prepare_backbone(backbone):
+    # Trace and cache the TorchScript artifact, so the measured run loads it like a restarted server would
+    with model_registry.use('intensity', backbone):
+        pass
+
+
+def bench_backbones(args):
+    clips = [(video_path, scene_times_of(video_path)) for video_path in args.videos]
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for backbone in args.backbones:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            pool.submit(_prepare_backbone, backbone).result()
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[backbone] = pool.submit(_run_backbone_case, backbone, clips).result()
+
+    reference = results[args.backbones[0]]['rankings']
+    print(f"{'backbone':>26} {'load s':>7} {'ms/frame':>8} {'peak RSS MB':>11} {'model MB':>8} "
+          f"{'spearman':>8} {'top5':>5}")
+    for backbone, result in results.items():
+        correlation = np.mean([spearman(a, b) for a, b in zip(reference, result['rankings'])])
+        overlap = np.mean([top_overlap(a, b, 5) for a, b in zip(reference, result['rankings'])])
+        print(f"{backbone:>26} {result['load_s']:>7.2f} {result['ms_per_frame']:>8.1f} "
+              f"{result['peak_rss_mb']:>11.0f} {result['model_mb']:>8.1f} {correlation:>8.2f} {overlap:>5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    intensity = subparsers.add_parser('intensity', help='wall time and ranking agreement of the motion cascade '
+                                                        'vs. the CNN on every scene')
+    intensity.add_argument('videos', nargs='+')
+    intensity.add_argument('--top-k', type=int, default=20, help='scenes the cascade passes to the CNN')
+    intensity.set_defaults(func=bench_intensity)
+
+    backbones = subparsers.add_parser('backbones', help='load time, per-frame latency, memory and ranking '
+                                                        'correlation of each intensity backbone')
+    backbones.add_argument('videos', nargs='+')
+    backbones.add_argument('--backbones', nargs='+', default=list(BACKBONES),
+                           help='models to compare; rankings are compared to the first')
+    backbones.set_defaults(func=bench_backbones)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cut threshold per scene detection method: mean HSV difference (0-255) for
+# content, 1 - correlation of hue/saturation histograms for histogram
+SCENE_THRESHOLDS = {'content': 30.0, 'histogram': 0.4}
+
+# Hue and saturation bins of the histogram detector
+HISTOGRAM_BINS = (16, 16)
+
+
+class AnalysisFrame:
+    """
+    A decoded frame at analysis resolution (bgr), plus the frame as decoded
+    (source) for analyzers that need the detail. Colour conversions are done
+    once and shared by all analyzers.
+    """
+
+    def __init__(self, timestamp, bgr, source=None):
+        self.timestamp = timestamp
+        self.bgr = bgr
+        self.source = bgr if source is None else source
+        self._hsv = None
+        self._gray = None
+
+    @property
+    def hsv(self):
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2HSV)
+        return self._hsv
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+
+class FrameAnalyzer:
+    """
+    Base class for analyzers fed by run_analysis().
+
+    process() is called with every sampled frame in order and finish() once with
+    the video duration; its return value is the analyzer's result, keyed by name.
+    """
+
+    name = None
+
+    def process(self, frame):
+        raise NotImplementedError
+
+    def finish(self, duration):
+        raise NotImplementedError
+
+
+class SceneCutAnalyzer(FrameAnalyzer):
+    """
+    Scene detection on the shared frames. A new scene starts wherever the change
+    from the previous compared frame reaches threshold, measured by method:
+
+    - 'content': mean absolute HSV difference, like scenedetect's detect-content;
+    - 'histogram': 1 - correlation of hue/saturation histograms, less sensitive
+      to camera and subject motion.
+
+    Frames are shrunk by downscale before comparing and only every frame_skip-th
+    frame is compared. Result: NumPy array of scene boundaries, starting at 0
+    and ending at the duration; scene i spans boundaries[i] to boundaries[i + 1].
+    The cut attribute tells analyzers running after this one whether the
+    current frame starts a scene.
+    """
+
+    name = 'scenes'
+
+    def __init__(self, method='content', threshold=None, min_scene_len=0.5, downscale=1, frame_skip=1):
+        if method not in SCENE_THRESHOLDS:
+            raise ValueError(f"Unknown scene detection method {method}")
+        self.method = method
+        self.threshold = SCENE_THRESHOLDS[method] if threshold is None else threshold
+        self.min_scene_len = min_scene_len
+        self.downscale = downscale
+        self.frame_skip = frame_skip
+        self.starts = []
+        self.cut = False
+        self._seen = 0
+        self._previous = None
+
+    def process(self, frame):
+        self._seen += 1
+        self.cut = False
+        if (self._seen - 1) % self.frame_skip:
+            return
+
+        if self.downscale > 1:
+            h, w = frame.bgr.shape[:2]
+            small = cv2.resize(frame.bgr, (max(1, w // self.downscale), max(1, h // self.downscale)),
+                               interpolation=cv2.INTER_AREA)
+            hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        else:
+            hsv = frame.hsv
+        if self.method == 'content':
+            signature = hsv.astype(np.int16)
+        else:
+            signature = cv2.calcHist([hsv], [0, 1], None, HISTOGRAM_BINS, [0, 180, 0, 256])
+
+        if self._previous is None:
+            self.cut = True
+        elif frame.timestamp - self.starts[-1] >= self.min_scene_len:
+            if self.method == 'content':
+                change = np.abs(signature - self._previous).mean()
+            else:
+                change = 1.0 - cv2.compareHist(signature, self._previous, cv2.HISTCMP_CORREL)
+            self.cut = change >= self.threshold
+        if self.cut:
+            self.starts.append(frame.timestamp)
+        self._previous = signature
+
+    def finish(self, duration):
+        return np.asarray(self.starts + [duration], dtype=np.float64)
+
+
+class KeyframeAnalyzer(FrameAnalyzer):
+    """
+    First frame of every scene found by scene_cuts, which must come before it in
+    the analyzer list.
+
+    Keyframes are taken from the decoded frame and shrunk so their short side is
+    min_size (never enlarged), so a model fed them sees the same detail as from
+    a separate read. min_size None keeps the analysis frame instead, which costs
+    no extra memory but scores a model on upscaled low-resolution input.
+    """
+
+    name = 'keyframes'
+
+    def __init__(self, scene_cuts, min_size=224):
+        self.scene_cuts = scene_cuts
+        self.min_size = min_size
+        self.frames = []
+
+    def process(self, frame):
+        if not self.scene_cuts.cut:
+            return
+        if self.min_size is None:
+            self.frames.append(frame.bgr)
+            return
+        h, w = frame.source.shape[:2]
+        scale = self.min_size / min(h, w)
+        if scale < 1:
+            self.frames.append(cv2.resize(frame.source, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                          interpolation=cv2.INTER_AREA))
+        else:
+            # Already small: copy, since the source frame isn't kept past this call
+            self.frames.append(frame.source.copy())
+
+    def finish(self, duration):
+        return self.frames
+
+
+class MotionAnalyzer(FrameAnalyzer):
+    """Motion energy: mean absolute grayscale difference between consecutive sampled frames.
+
+    Result: (times, energy) arrays.
+    """
+
+    name = 'motion'
+
+    def __init__(self):
+        self.times = []
+        self.energy = []
+        self._previous = None
+
+    def process(self, frame):
+        gray = frame.gray.astype(np.int16)
+        self.times.append(frame.timestamp)
+        self.energy.append(0.0 if self._previous is None else float(np.abs(gray - self._previous).mean()))
+        self._previous = gray
+
+    def finish(self, duration):
+        return np.asarray(self.times), np.asarray(self.energy)
+
+
+class HistogramChangeAnalyzer(FrameAnalyzer):
+    """Change in the grayscale histogram between consecutive sampled frames, in [0, 1]
+    (half the L1 distance between the normalized histograms).
+
+    Result: (times, change) arrays.
+    """
+
+    name = 'histogram_change'
+
+    def __init__(self, bins=16):
+        self.bins = bins
+        self.times = []
+        self.change = []
+        self._previous = None
+
+    def process(self, frame):
+        gray = frame.gray
+        histogram = np.bincount(gray.ravel() // (256 // self.bins), minlength=self.bins) / gray.size
+        self.times.append(frame.timestamp)
+        self.change.append(0.0 if self._previous is None else 0.5 * float(np.abs(histogram - self._previous).sum()))
+        self._previous = histogram
+
+    def finish(self, duration):
+        return np.asarray(self.times), np.asarray(self.change)
+
+
+class ThumbnailAnalyzer(FrameAnalyzer):
+    """A JPEG-encoded frame every interval seconds. Result: (times array, list of JPEG bytes)."""
+
+    name = 'thumbnails'
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.times = []
+        self.images = []
+
+    def process(self, frame):
+        if not self.times or frame.timestamp - self.times[-1] >= self.interval:
+            success, encoded = cv2.imencode('.jpg', frame.bgr)
+            if success:
+                self.times.append(frame.timestamp)
+                self.images.append(encoded.tobytes())
+
+    def finish(self, duration):
+        return np.asarray(self.times), self.images
+
+
+def run_analysis(video_path, analyzers, fps=10.0, width=320, frame_skip=1):
+    """
+    Decode video_path once and feed every analyzer the same frames.
+
+    Frames are sampled at about fps per second (every frame_skip-th source frame
+    if fps is None) and downscaled to width pixels wide; the decoded frame stays
+    available to analyzers as frame.source. Frames that are skipped are only
+    grabbed, not converted. Returns {analyzer.name: result}.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video {video_path}")
+
+    source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    step = max(1, round(source_fps / fps)) if fps else frame_skip
+    index = 0
+    try:
+        while True:
+            if index % step:
+                if not cap.grab():
+                    break
+            else:
+                success, source = cap.read()
+                if not success:
+                    break
+                h, w = source.shape[:2]
+                image = source
+                if width and w > width:
+                    image = cv2.resize(source, (width, max(2, round(h * width / w))), interpolation=cv2.INTER_AREA)
+                frame = AnalysisFrame(index / source_fps, image, source)
+                for analyzer in analyzers:
+                    analyzer.process(frame)
+            index += 1
+    finally:
+        cap.release()
+
+    duration = index / source_fps
+    logger.info(f"Analyzed {(index + step - 1) // step} of {index} frames ({duration:.1f}s) in one pass")
+    return {analyzer.name: analyzer.finish(duration) for analyzer in analyzers}
+
+
+def detect_scenes(video_path, method='content', threshold=None, min_scene_len=0.5, width=320, frame_skip=1):
+    """Scene boundaries of video_path on their own, comparing every frame_skip-th frame shrunk to width pixels."""
+    scene_cuts = SceneCutAnalyzer(method, threshold, min_scene_len)
+    return run_analysis(video_path, [scene_cuts], fps=None, width=width, frame_skip=frame_skip)['scenes']
+
+
+def window_mean(times, values, start, end):
+    """Mean of the values sampled at times within [start, end), 0 if there are none."""
+    lo, hi = np.searchsorted(times, [start, end])
+    return float(values[lo:hi].mean()) if hi > lo else 0.0
+
+
+def scene_means(times, values, boundaries):
+    """
+    Mean of a per-frame signal within each scene. The first sample of a scene is
+    left out, since frame differences there measure the cut itself. Scenes with
+    no other sample get 0.
+    """
+    hi = np.searchsorted(times, boundaries[1:])
+    lo = np.minimum(np.searchsorted(times, boundaries[:-1]) + 1, hi)
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    counts = hi - lo
+    return np.where(counts > 0, (sums[hi] - sums[lo]) / np.maximum(counts, 1), 0.0)
+
+
+def nearest_thumbnail(thumbnails, timestamp):
+    times, images = thumbnails
+    if not images:
+        return None
+    return images[int(np.abs(times - timestamp).argmin())]
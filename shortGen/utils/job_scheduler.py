@@ -0,0 +1,75 @@
+import heapq
+import itertools
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobScheduler:
+    """
+    Fixed pool of worker threads running queued jobs by priority, oldest first
+    within a priority.
+
+    At most max_queued jobs may wait for a worker; submit() raises QueueFullError
+    past that. stage_limits caps how many jobs run a given stage at once (e.g.
+    only one Whisper transcription), whatever the number of workers; jobs enter
+    a stage through the stage() context manager.
+    """
+
+    def __init__(self, max_workers, max_queued, stage_limits=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._stages = {name: threading.BoundedSemaphore(limit) for name, limit in (stage_limits or {}).items()}
+        self._queue = []  # heap of (priority, sequence, job_id, fn, args)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job_id, fn, *args, priority='normal', force=False):
+        # force skips the depth limit, for jobs that were already accepted (e.g. recovered after a restart)
+        with self._cond:
+            if not force and len(self._queue) >= self.max_queued:
+                raise QueueFullError('Job queue is full')
+            heapq.heappush(self._queue, (PRIORITIES[priority], next(self._sequence), job_id, fn, args))
+            self._cond.notify()
+
+    def is_full(self):
+        with self._cond:
+            return len(self._queue) >= self.max_queued
+
+    def stats(self):
+        with self._cond:
+            return {'queued': len(self._queue), 'running': self._running, 'workers': self.max_workers}
+
+    @contextmanager
+    def stage(self, name):
+        # Blocks until the stage has a free slot; stages without a limit don't wait
+        with self._stages.get(name) or nullcontext():
+            yield
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, job_id, fn, args = heapq.heappop(self._queue)
+                self._running += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Job {job_id} raised: {str(e)}")
+            finally:
+                with self._cond:
+                    self._running -= 1
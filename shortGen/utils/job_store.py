@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.job_scheduler import PRIORITIES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    priority INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    num_highlights INTEGER NOT NULL,
+    min_duration INTEGER NOT NULL,
+    max_duration INTEGER NOT NULL,
+    error TEXT,
+    result_files TEXT,
+    metadata TEXT,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+"""
+
+# Columns update() may set; the JSON ones hold lists
+UPDATABLE = {'status', 'progress', 'error', 'result_files', 'metadata', 'owner'}
+JSON_COLUMNS = {'result_files', 'metadata'}
+
+PRIORITY_NAMES = {rank: name for name, rank in PRIORITIES.items()}
+
+
+def _process_token(pid):
+    """
+    "<pid>:<start time>" identifying a running process, or None if there is no
+    such process. The start time tells apart a later process that reused the
+    pid, e.g. a restarted container's PID 1 or a respawned gunicorn worker.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Field 22, counted after the parenthesized command name which may contain spaces
+            start_time = f.read().rsplit(')', 1)[1].split()[19]
+        return f"{pid}:{start_time}"
+    except FileNotFoundError:
+        if os.path.isdir('/proc'):
+            return None
+    if os.name == 'nt':
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows; ask the kernel for the creation time
+        return _windows_process_token(pid)
+    # Other POSIX systems without procfs: fall back to the pid alone
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return str(pid)
+
+
+def _windows_process_token(pid):
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    # PROCESS_QUERY_LIMITED_INFORMATION; our own server processes always grant it, so
+    # failing to open means the pid is gone or now belongs to someone else's process
+    handle = kernel32.OpenProcess(0x1000, False, pid)
+    if not handle:
+        return None
+    try:
+        exit_code = wintypes.DWORD()
+        creation, exit_time, kernel, user = (wintypes.FILETIME() for _ in range(4))
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)) or exit_code.value != 259:
+            # Anything but STILL_ACTIVE: the process has exited
+            return None
+        if not kernel32.GetProcessTimes(handle, ctypes.byref(creation), ctypes.byref(exit_time),
+                                        ctypes.byref(kernel), ctypes.byref(user)):
+            return None
+        return f"{pid}:{(creation.dwHighDateTime << 32) | creation.dwLowDateTime}"
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _owner_alive(owner):
+    pid = int(str(owner).split(':')[0])
+    return _process_token(pid) == str(owner)
+
+
+class JobStore:
+    """
+    Job state in a SQLite database, shared by every process of the server.
+
+    Each write is a single statement, so progress updates from worker threads
+    never interleave. A job is owned by the process that queued it (its pid and
+    start time are kept in owner); claim() moves it from queued to processing
+    only once, and recover() hands the jobs of processes that have died to the
+    caller.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._owner = (None, None)
+        self._local = threading.local()
+        conn = self._conn()
+        # WAL lets readers in other processes carry on while a worker writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+
+    @property
+    def owner(self):
+        # Taken per process: workers forked after the store was created must not share the parent's token
+        pid, token = self._owner
+        if pid != os.getpid():
+            self._owner = pid, token = os.getpid(), _process_token(os.getpid())
+        return token
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id, filename, file_path, num_highlights, highlight_duration, priority='normal'):
+        now = time.time()
+        self._conn().execute(
+            'INSERT INTO jobs (id, filename, file_path, status, progress, priority, created_at, updated_at, '
+            'num_highlights, min_duration, max_duration, owner) VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, filename, file_path, 'queued', PRIORITIES[priority], now, now, num_highlights,
+             highlight_duration[0], highlight_duration[1], self.owner))
+
+    def get(self, job_id):
+        row = self._conn().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def update(self, job_id, **fields):
+        unknown = set(fields) - UPDATABLE
+        if unknown:
+            raise ValueError(f"Can't update job fields: {', '.join(sorted(unknown))}")
+        values = [json.dumps(value) if name in JSON_COLUMNS else value for name, value in fields.items()]
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._conn().execute(f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                             (*values, time.time(), job_id))
+
+    def claim(self, job_id):
+        """Mark a queued job as processing; False if it isn't queued (already taken or deleted)."""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'processing', owner = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+            (self.owner, time.time(), job_id))
+        return cursor.rowcount == 1
+
+    def delete(self, job_id):
+        self._conn().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def list(self, status=None, created_after=None, created_before=None, limit=100):
+        """Jobs newest first, optionally filtered by status and a created_at range; limit None for all."""
+        clauses, params = [], []
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(status)
+        if created_after is not None:
+            clauses.append('created_at >= ?')
+            params.append(created_after)
+        if created_before is not None:
+            clauses.append('created_at < ?')
+            params.append(created_before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._conn().execute(f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?",
+                                    (*params, -1 if limit is None else limit)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def counts(self):
+        rows = self._conn().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: n for status, n in rows}
+
+    def queue_position(self, job_id):
+        """1-based position among all queued jobs in scheduling order, or None if the job isn't queued."""
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM jobs AS other, jobs AS job WHERE job.id = ? AND job.status = 'queued' "
+            "AND other.status = 'queued' AND (other.priority < job.priority OR "
+            "(other.priority = job.priority AND other.created_at <= job.created_at))", (job_id,)).fetchone()
+        return row[0] or None
+
+    def recover(self):
+        """Take over unfinished jobs whose owning process is gone; they're returned queued again."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute("SELECT * FROM jobs WHERE status IN ('queued', 'processing') "
+                                "ORDER BY priority, created_at").fetchall()
+            orphans = [row for row in rows if row['owner'] is None or not _owner_alive(row['owner'])]
+            conn.executemany("UPDATE jobs SET status = 'queued', progress = 0, owner = ?, updated_at = ? "
+                             "WHERE id = ?", [(self.owner, time.time(), row['id']) for row in orphans])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return [self.get(row['id']) for row in orphans]
+
+    def _to_dict(self, row):
+        job = {
+            'id': row['id'],
+            'filename': row['filename'],
+            'file_path': row['file_path'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'priority': PRIORITY_NAMES[row['priority']],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'num_highlights': row['num_highlights'],
+            'highlight_duration': (row['min_duration'], row['max_duration']),
+        }
+        if row['error'] is not None:
+            job['error'] = row['error']
+        for name in JSON_COLUMNS:
+            if row[name] is not None:
+                job[name] = json.loads(row[name])
+        return job
@@ -0,0 +1,245 @@
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Loaded models are evicted least recently used first once they take more than this
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get('MODEL_MEMORY_BUDGET_MB', 3072))
+# Where traced and frozen TorchScript intensity models are kept between runs
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', 'model_cache')
+# Backbone scoring the scenes, optionally int8: resnet50, mobilenet_v3_large or efficientnet_b0,
+# with "+dynamic" or "+static" (resnet50 and mobilenet_v3_large only) for quantization
+INTENSITY_BACKBONE = os.environ.get('INTENSITY_BACKBONE', 'resnet50')
+
+# Intensity backbones: torchvision constructor and weights enum
+INTENSITY_BACKBONES = {
+    'resnet50': ('resnet50', 'ResNet50_Weights'),
+    'mobilenet_v3_large': ('mobilenet_v3_large', 'MobileNet_V3_Large_Weights'),
+    'efficientnet_b0': ('efficientnet_b0', 'EfficientNet_B0_Weights'),
+}
+# Backbones torchvision ships calibrated static int8 weights for
+STATIC_QUANTIZED_WEIGHTS = {
+    'resnet50': 'ResNet50_QuantizedWeights',
+    'mobilenet_v3_large': 'MobileNet_V3_Large_QuantizedWeights',
+}
+INTENSITY_INPUT_SHAPE = (1, 3, 224, 224)
+# Model specs from before intensity backbones were selectable, and the (kind, name) they stand for
+LEGACY_MODEL_SPECS = {'resnet50': ('intensity', 'resnet50')}
+
+
+def model_size(model):
+    """Bytes held by a torch module's parameters and buffers."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def get_device():
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def load_whisper(size):
+    import whisper
+    return whisper.load_model(size, device=get_device())
+
+
+def parse_backbone(name):
+    """Split an intensity model name such as "mobilenet_v3_large+static" into (backbone, quantization)."""
+    backbone, _, quantization = (name or INTENSITY_BACKBONE).partition('+')
+    if backbone not in INTENSITY_BACKBONES:
+        raise ValueError(f"Unknown intensity backbone {backbone}")
+    if quantization not in ('', 'dynamic', 'static'):
+        raise ValueError(f"Unknown quantization {quantization}, expected dynamic or static")
+    if quantization == 'static' and backbone not in STATIC_QUANTIZED_WEIGHTS:
+        raise ValueError(f"No static int8 weights for {backbone}")
+    return backbone, quantization or None
+
+
+def intensity_model_name(name):
+    """Canonical intensity model name, INTENSITY_BACKBONE if name is empty."""
+    backbone, quantization = parse_backbone(name)
+    return f"{backbone}+{quantization}" if quantization else backbone
+
+
+def intensity_device(name):
+    # Quantized kernels only run on the CPU
+    return 'cpu' if parse_backbone(name)[1] else get_device()
+
+
+def build_intensity_model(name):
+    """Eager torchvision model for an intensity model name, int8 quantized if the name asks for it."""
+    import torch
+    from torchvision import models
+
+    backbone, quantization = parse_backbone(name)
+    if quantization == 'static':
+        weights = getattr(models.quantization, STATIC_QUANTIZED_WEIGHTS[backbone]).DEFAULT
+        model = getattr(models.quantization, backbone)(weights=weights, quantize=True)
+    else:
+        constructor, weights = INTENSITY_BACKBONES[backbone]
+        model = getattr(models, constructor)(weights=getattr(models, weights).DEFAULT)
+        if quantization == 'dynamic':
+            # Dynamic quantization covers the linear layers, i.e. the classifier heads
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model
+
+
+def torchscript_path(name):
+    import torch
+    import torchvision
+    backbone, quantization = parse_backbone(name)
+    # Artifacts depend on the library versions that traced them
+    tag = f"{backbone}-{quantization or 'fp32'}-torch{torch.__version__}-tv{torchvision.__version__}"
+    return os.path.join(MODEL_CACHE_DIR, f"{tag}.pt")
+
+
+def load_intensity_model(name=None):
+    """
+    Frozen TorchScript intensity model, traced on first use and cached on disk so
+    later starts load it directly.
+    """
+    import torch
+
+    path = torchscript_path(name)
+    if not os.path.exists(path):
+        logger.info(f"Tracing intensity model {intensity_model_name(name)} to {path}")
+        model = build_intensity_model(name)
+        with torch.no_grad():
+            frozen = torch.jit.freeze(torch.jit.trace(model, torch.rand(INTENSITY_INPUT_SHAPE)))
+        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+        # Several workers may trace at once; each renames a complete file into place
+        fd, tmp_path = tempfile.mkstemp(dir=MODEL_CACHE_DIR, suffix='.pt')
+        os.close(fd)
+        try:
+            torch.jit.save(frozen, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return torch.jit.load(path, map_location=intensity_device(name))
+
+
+def intensity_model_size(name):
+    # Frozen modules hold their weights as graph constants, not parameters; the artifact size stands in
+    return os.path.getsize(torchscript_path(name))
+
+
+class _Entry:
+    def __init__(self):
+        self.model = None
+        self.size = 0
+        self.users = 0
+        self.load_lock = threading.Lock()
+        self.use_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models shared by all jobs.
+
+    Each (kind, name) model is loaded once, lazily, the first time a job asks for
+    it; concurrent requests for the same model wait for that single load. When the
+    loaded models exceed the memory budget, the least recently used ones that no
+    job is using are dropped. Kinds registered as exclusive are handed to one job
+    at a time, for models that keep state while they run (Whisper installs
+    decoding hooks on the module).
+    """
+
+    def __init__(self, memory_budget_mb=MODEL_MEMORY_BUDGET_MB):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._loaders = {}
+        self._entries = OrderedDict()  # (kind, name) -> _Entry, least recently used first
+        self._lock = threading.Lock()
+
+    def register(self, kind, loader, exclusive=False, size=None, normalize=None):
+        # size(name) gives a loaded model's bytes when its parameters don't tell (default model_size);
+        # normalize(name) gives the canonical name, so aliases such as a default of None share one entry
+        self._loaders[kind] = (loader, exclusive, size, normalize)
+
+    def key(self, kind, name=None):
+        """(kind, canonical name) a model is cached under; ValueError for unknown kinds or names."""
+        if kind not in self._loaders:
+            raise ValueError(f"Unknown model kind {kind}, expected one of {', '.join(sorted(self._loaders))}")
+        normalize = self._loaders[kind][3]
+        return kind, normalize(name) if normalize else name
+
+    @contextmanager
+    def use(self, kind, name=None):
+        """Context manager yielding the loaded model, loading it first if needed."""
+        kind, name = key = self.key(kind, name)
+        loader, exclusive, size, _ = self._loaders[kind]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            self._entries.move_to_end(key)
+            # A model in use is never evicted
+            entry.users += 1
+
+        try:
+            with entry.load_lock:
+                if entry.model is None:
+                    logger.info(f"Loading model {kind} {name or ''}".rstrip())
+                    entry.model = loader(name)
+                    entry.size = size(name) if size else model_size(entry.model)
+                    self._evict()
+            with entry.use_lock if exclusive else nullcontext():
+                yield entry.model
+        finally:
+            with self._lock:
+                entry.users -= 1
+
+    def preload(self, specs):
+        """Load models ahead of the first job; specs is a list of (kind, name) pairs."""
+        for kind, name in specs:
+            try:
+                with self.use(kind, name):
+                    pass
+            except Exception as e:
+                logger.error(f"Failed to preload model {kind} {name or ''}: {str(e)}")
+
+    def loaded(self):
+        with self._lock:
+            return [{'kind': kind, 'name': name, 'size_mb': entry.size / (1024 * 1024)}
+                    for (kind, name), entry in self._entries.items() if entry.model is not None]
+
+    def _evict(self):
+        with self._lock:
+            total = sum(entry.size for entry in self._entries.values() if entry.model is not None)
+            for key, entry in list(self._entries.items()):
+                if total <= self.memory_budget:
+                    break
+                if entry.users or entry.model is None:
+                    continue
+                logger.info(f"Evicting model {key[0]} {key[1] or ''}".rstrip())
+                total -= entry.size
+                entry.model = None
+                del self._entries[key]
+
+
+def parse_model_specs(value):
+    """
+    Parse "whisper:base,intensity" into [('whisper', 'base'), ('intensity', 'resnet50')],
+    names normalized as the registry caches them. Raises ValueError for unknown
+    kinds or names.
+    """
+    specs = []
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            kind, _, name = item.partition(':')
+            if not name and kind in LEGACY_MODEL_SPECS:
+                kind, name = LEGACY_MODEL_SPECS[kind]
+            specs.append(model_registry.key(kind, name or None))
+    return specs
+
+
+model_registry = ModelRegistry()
+model_registry.register('whisper', load_whisper, exclusive=True)
+model_registry.register('intensity', load_intensity_model, size=intensity_model_size,
+                        normalize=intensity_model_name)
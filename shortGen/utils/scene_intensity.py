@@ -1,44 +1,165 @@
+import os
+
 import torch
-import torchvision.transforms as transforms
-from PIL import Image
 import cv2
 import numpy as np
-from torchvision import models
 
-def analyze_scene_intensity(video_path, scene_times):
-    """Analyze scene intensity using ResNet model."""
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    model = models.resnet50(pretrained=True).to(device)
-    model.eval()
+from utils.model_registry import INTENSITY_BACKBONE, intensity_device, model_registry
 
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-    ])
+# Scenes scored per forward pass
+INTENSITY_BATCH_SIZE = int(os.environ.get('INTENSITY_BATCH_SIZE', 16))
+# Intra-op threads for CPU inference; 0 keeps torch's default of one per physical core
+INTENSITY_THREADS = int(os.environ.get('INTENSITY_THREADS', 0))
+# Gaps between keyframes longer than this are seeked over instead of decoded through
+SEEK_GAP_SECONDS = 10.0
+# Only this many scenes, the most active by the cheap motion score, go through the CNN; 0 for all
+INTENSITY_TOP_K = int(os.environ.get('INTENSITY_TOP_K', 20) or 0) or None
+# Frames sampled per scene for the motion score when no analysis pass provided it
+MOTION_SAMPLES = 5
+# Grayscale size the sampled frames are compared at
+MOTION_SIZE = (64, 36)
 
-    intensity_scores = []
+INPUT_SIZE = 224
 
-    for i, (start_time, end_time) in enumerate(scene_times):
-        cap = cv2.VideoCapture(video_path)
-        cap.set(cv2.CAP_PROP_POS_MSEC, start_time * 1000)
-        success, frame = cap.read()
-
-        if success:
-            img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            img_tensor = transform(img).unsqueeze(0).to(device)
-
-            with torch.no_grad():
-                features = model(img_tensor)
-                score = features.norm().item()  # Normalize as intensity score
-                intensity_scores.append({
-                    'scene': i + 1,
-                    'start_time': start_time,
-                    'end_time': end_time,
-                    'intensity': score
-                })
 
+def read_keyframes(video_path, start_times):
+    """First frame at each start time, read in one pass over a single capture in time order.
+
+    Returns BGR frames aligned with start_times, None where a frame couldn't be read.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = [None] * len(start_times)
+    index = 0  # index of the frame the next read returns
+    last_index, last_frame = -1, None
+    try:
+        for i in sorted(range(len(start_times)), key=lambda i: start_times[i]):
+            target = max(0, int(round(start_times[i] * fps)))
+            if target - index > SEEK_GAP_SECONDS * fps:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                index = target
+            success = True
+            while success and index <= target:
+                if index < target:
+                    success = cap.grab()
+                else:
+                    success, last_frame = cap.read()
+                    last_index = index
+                index += 1
+            if not success:
+                break
+            # Scenes starting on the same frame share it
+            if last_index == target:
+                frames[i] = last_frame
+    finally:
         cap.release()
+    return frames
+
+
+def preprocess(frames):
+    """BGR frames to a float RGB batch tensor (N, 3, 224, 224) in [0, 1]."""
+    batch = np.stack([cv2.resize(frame, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+                      for frame in frames])
+    batch = np.ascontiguousarray(batch[..., ::-1])
+    return torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255)
+
+
+def sampled_motion_features(video_path, scene_times, samples=MOTION_SAMPLES):
+    """
+    Motion energy (mean absolute difference, 0-255) and histogram change (0-1)
+    between samples frames spread evenly over each scene, the first being the
+    scene's first frame. Returns (energy, change, keyframes), keyframes being
+    the first samples (BGR, None where unreadable).
+    """
+    n = len(scene_times)
+    times = np.asarray(scene_times, dtype=np.float64).reshape(n, 2)
+    sample_times = times[:, :1] + (times[:, 1:] - times[:, :1]) * (np.arange(samples) / samples)
+    frames = read_keyframes(video_path, sample_times.ravel().tolist())
+
+    small = np.zeros((n * samples, MOTION_SIZE[1] * MOTION_SIZE[0]), dtype=np.int16)
+    for j, frame in enumerate(frames):
+        if frame is not None:
+            small[j] = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), MOTION_SIZE,
+                                  interpolation=cv2.INTER_AREA).ravel()
+        elif j % samples:
+            # A missing sample repeats the previous one, so it adds no change
+            small[j] = small[j - 1]
+    small = small.reshape(n, samples, -1)
+
+    energy = np.abs(np.diff(small, axis=1)).mean(axis=(1, 2))
+    # 16-bin histograms of every sample at once: offset each sample's bins into its own range
+    bins = (small >> 4) + 16 * np.arange(n * samples).reshape(n, samples, 1)
+    histograms = np.bincount(bins.ravel(), minlength=n * samples * 16).reshape(n, samples, 16) / small.shape[2]
+    change = 0.5 * np.abs(np.diff(histograms, axis=1)).sum(axis=2).mean(axis=1)
+    return energy, change, frames[::samples]
+
+
+def motion_scores(energy, change):
+    """Cheap per-scene activity score in [0, 1]: min-max normalized energy and histogram change, averaged."""
+    def normalize(values):
+        values = np.asarray(values, dtype=np.float64)
+        spread = values.max() - values.min() if len(values) else 0.0
+        return (values - values.min()) / spread if spread > 0 else np.zeros_like(values)
+    return 0.5 * (normalize(energy) + normalize(change))
+
+
+def analyze_scene_intensity(video_path, scene_times, keyframes=None, batch_size=INTENSITY_BATCH_SIZE,
+                            top_k=INTENSITY_TOP_K, motion=None, backbone=INTENSITY_BACKBONE):
+    """Analyze scene intensity with a cheap-first cascade.
+
+    Every scene gets a NumPy motion score from frame differences and histogram
+    change; only the top_k most active (all if top_k is None) are then scored by
+    the backbone CNN (shared through the model registry). motion, if given, is a pair of
+    per-scene (energy, change) arrays already measured, e.g. by the analysis
+    pass; otherwise MOTION_SAMPLES frames per scene are read. keyframes, if given,
+    holds each scene's first frame (BGR) already decoded.
+
+    Returns every scene with its 'motion' score and its CNN 'intensity' (None
+    if not scored): the CNN-scored scenes first, most intense first, then the
+    rest by motion.
+    """
+    n = len(scene_times)
+    if top_k is not None and top_k < n and motion is None:
+        *motion, sampled_keyframes = sampled_motion_features(video_path, scene_times)
+        if keyframes is None:
+            keyframes = sampled_keyframes
+    motion_score = motion_scores(*motion) if motion is not None else np.zeros(n)
+
+    if top_k is None or top_k >= n:
+        candidates = list(range(n))
+    else:
+        candidates = np.argsort(-motion_score, kind='stable')[:top_k].tolist()
+    if keyframes is None:
+        frames = read_keyframes(video_path, [scene_times[i][0] for i in candidates])
+    else:
+        frames = [keyframes[i] for i in candidates]
+    scenes = [(i, frame) for i, frame in zip(candidates, frames) if frame is not None]
+
+    intensity = {}
+    if scenes:
+        device = intensity_device(backbone)
+        if device == 'cpu' and INTENSITY_THREADS:
+            torch.set_num_threads(INTENSITY_THREADS)
+
+        with model_registry.use('intensity', backbone) as model, torch.inference_mode():
+            for b in range(0, len(scenes), batch_size):
+                chunk = scenes[b:b + batch_size]
+                batch = preprocess([frame for _, frame in chunk]).to(device)
+                # Norm of each scene's logits as its intensity score
+                scores = model(batch).norm(dim=1).tolist()
+                for (i, _), score in zip(chunk, scores):
+                    intensity[i] = score
+
+    intensity_scores = []
+    for i, (start_time, end_time) in enumerate(scene_times):
+        intensity_scores.append({
+            'scene': i + 1,
+            'start_time': start_time,
+            'end_time': end_time,
+            'motion': float(motion_score[i]),
+            'intensity': intensity.get(i)
+        })
 
     # Sort by intensity for selecting top highlights
-    intensity_scores.sort(key=lambda x: x['intensity'], reverse=True)
-    return intensity_scores[:5]  # Top 5 intense scenes
+    intensity_scores.sort(key=lambda x: (x['intensity'] is not None, x['intensity'] or 0.0, x['motion']), reverse=True)
+    return intensity_scores
@@ -11,11 +11,14 @@ from werkzeug.utils import secure_filename
 
 # Import video processing functions
 import moviepy.editor as mp
-import whisper
-import subprocess
-import pandas as pd
+import numpy as np
 
 # Import new modules
+from utils.frame_analysis import (HistogramChangeAnalyzer, KeyframeAnalyzer, MotionAnalyzer, SceneCutAnalyzer,
+                                  ThumbnailAnalyzer, nearest_thumbnail, run_analysis, scene_means, window_mean)
+from utils.job_scheduler import PRIORITIES, JobScheduler, QueueFullError
+from utils.job_store import JobStore
+from utils.model_registry import model_registry, parse_model_specs
 from utils.scene_intensity import analyze_scene_intensity
 from utils.sentiment_analysis import analyze_sentiment
 from utils.youtube_uploader import authenticate_youtube, upload_video
@@ -37,6 +40,33 @@ UPLOAD_FOLDER = 'uploads'
 RESULTS_FOLDER = 'results'
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
 MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB max upload size
+WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'base')
+# Models loaded at startup instead of by the first job, e.g. "whisper:base,intensity:mobilenet_v3_large+static";
+# an unknown model kind or name stops the server from starting
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '')
+# Jobs processed at once, and how many more may wait before uploads get a 429
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 2))
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', 20))
+# Running jobs inside each heavy stage at once
+STAGE_LIMITS = {
+    'transcribe': int(os.environ.get('MAX_CONCURRENT_TRANSCRIPTIONS', 1)),
+    'scene_analysis': int(os.environ.get('MAX_CONCURRENT_SCENE_ANALYSIS', 1)),
+    'render': int(os.environ.get('MAX_CONCURRENT_RENDERS', 2)),
+}
+# Resolution and frame rate of the single decoding pass shared by scene detection and the other analyzers
+ANALYSIS_WIDTH = int(os.environ.get('ANALYSIS_WIDTH', 320))
+ANALYSIS_FPS = float(os.environ.get('ANALYSIS_FPS', 10))
+# Scene detection on the analysis frames: 'content' or 'histogram', the cut threshold (method
+# default if unset), a further downscale factor and comparing only every SCENE_FRAME_SKIP-th frame
+SCENE_METHOD = os.environ.get('SCENE_METHOD', 'content')
+SCENE_THRESHOLD = float(os.environ['SCENE_THRESHOLD']) if os.environ.get('SCENE_THRESHOLD') else None
+SCENE_DOWNSCALE = int(os.environ.get('SCENE_DOWNSCALE', 1))
+SCENE_FRAME_SKIP = int(os.environ.get('SCENE_FRAME_SKIP', 1))
+# Short side, in pixels, of the scene keyframes kept for the intensity CNN (224, its input size, by default);
+# 0 reuses the ANALYSIS_WIDTH frames, saving memory at the cost of scoring upscaled low-resolution input
+KEYFRAME_SIZE = int(os.environ.get('KEYFRAME_SIZE', 224)) or None
+# SQLite database holding job state, shared by all server processes
+JOBS_DB = os.environ.get('JOBS_DB', 'jobs.db')
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -46,8 +76,18 @@ os.makedirs('temp', exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
-# Dictionary to store job status
-jobs = {}
+# Job status, persisted so it survives restarts and is visible to every worker process
+job_store = JobStore(JOBS_DB)
+
+# Run directly, app.run(debug=True) re-runs this module in a reloader child that serves the requests
+# (WERKZEUG_RUN_MAIN set); the parent only watches for file changes and must not take jobs or load models
+RELOADER_PARENT = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+scheduler = JobScheduler(MAX_WORKERS, MAX_QUEUED_JOBS, STAGE_LIMITS)
+
+# Warm the models in the background so the server starts accepting uploads right away
+if PRELOAD_MODELS and not RELOADER_PARENT:
+    threading.Thread(target=model_registry.preload, args=(parse_model_specs(PRELOAD_MODELS),), daemon=True).start()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -133,6 +173,11 @@ def merge_scores(sentiment_scores, intensity_scores, weight_sentiment=0.4, weigh
 # Video processing function
 def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20, 30)):
     """Process a video file to generate highlights"""
+    # Another process may have picked the job up after a restart, or it was cleaned up
+    if not job_store.claim(job_id):
+        logger.info(f"Job {job_id} is no longer queued, skipping")
+        return False
+
     # Path to your service account JSON key
     API_KEY_FILE = 'Recusion\shortGen\cred.json'
 
@@ -149,8 +194,7 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
         os.makedirs(job_folder, exist_ok=True)
         
         # Update job status
-        jobs[job_id]['status'] = 'processing'
-        jobs[job_id]['progress'] = 10
+        job_store.update(job_id, progress=10)
         
         # Load the video file
         clip = mp.VideoFileClip(video_path)
@@ -158,7 +202,7 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
         logger.info(f"Video loaded. Duration: {total_duration:.2f} seconds")
         
         # Update progress
-        jobs[job_id]['progress'] = 20
+        job_store.update(job_id, progress=20)
         
         # Check if audio exists
         has_audio = clip.audio is not None
@@ -171,12 +215,12 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
             clip.audio.write_audiofile(audio_path)
             
             # Update progress
-            jobs[job_id]['progress'] = 40
+            job_store.update(job_id, progress=40)
             
-            # Load whisper model and transcribe
+            # Transcribe with the shared whisper model (loaded once per process)
             try:
-                model = whisper.load_model("base")
-                result = model.transcribe(audio_path)
+                with scheduler.stage('transcribe'), model_registry.use('whisper', WHISPER_MODEL) as model:
+                    result = model.transcribe(audio_path)
                 transcript = result['text']
                 logger.info("Transcription completed")
                 
@@ -195,53 +239,38 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
                 os.remove(audio_path)
         
         # Update progress
-        jobs[job_id]['progress'] = 60
+        job_store.update(job_id, progress=60)
         
-        # Run scene detection
-        scenes_file = os.path.abspath(os.path.join('temp', f"{job_id}_scenes.csv"))
-        scene_output_dir = os.path.abspath(os.path.join('temp', f"{job_id}_scenes"))
-        os.makedirs(scene_output_dir, exist_ok=True)
-        
-        scenes_df = None
+        # One decoding pass feeds scene detection, scene keyframes, motion energy, histogram change and thumbnails
+        boundaries = np.zeros(0)
+        scene_times = []
         intensity_scores = []
+        motion = thumbnails = None
         
         try:
-            subprocess.run([
-                'scenedetect',
-                '--input', video_path,
-                '--output', scene_output_dir,
-                'detect-content',
-                '--threshold', '30',
-                'list-scenes',
-                '--output', scenes_file
-            ], check=True)
-            
-            logger.info("Scene detection completed")
+            scene_cuts = SceneCutAnalyzer(SCENE_METHOD, SCENE_THRESHOLD, downscale=SCENE_DOWNSCALE,
+                                          frame_skip=SCENE_FRAME_SKIP)
+            analyzers = [scene_cuts, KeyframeAnalyzer(scene_cuts, KEYFRAME_SIZE), MotionAnalyzer(), HistogramChangeAnalyzer(),
+                         ThumbnailAnalyzer()]
+            with scheduler.stage('scene_analysis'):
+                analysis = run_analysis(video_path, analyzers, fps=ANALYSIS_FPS, width=ANALYSIS_WIDTH)
+            boundaries = analysis['scenes']
+            scene_times = list(zip(boundaries[:-1].tolist(), boundaries[1:].tolist()))
+            motion = analysis['motion']
+            thumbnails = analysis['thumbnails']
+            logger.info(f"Detected {len(scene_times)} scenes")
             
-            # Read the CSV file with scene information
-            if os.path.exists(scenes_file):
-                try:
-                    scenes_df = pd.read_csv(scenes_file)
-                    logger.info(f"Detected {len(scenes_df)} scenes")
-                    
-                    # Extract scene times
-                    scene_times = []
-                    if scenes_df is not None and len(scenes_df) > 0:
-                        scene_times = [
-                            (scenes_df.iloc[i]['Start Time (seconds)'], scenes_df.iloc[i]['End Time (seconds)'])
-                            for i in range(len(scenes_df))
-                        ]
-                    
-                    # Analyze intensity and update results
-                    intensity_scores = analyze_scene_intensity(video_path, scene_times)
-                    logger.info(f"Scene intensity analysis completed. Top scenes: {len(intensity_scores)}")
-                except Exception as e:
-                    logger.error(f"Error reading scene CSV: {str(e)}")
+            # Analyze intensity on the scene keyframes, with the CNN only on the most active scenes
+            scene_motion = (scene_means(*motion, boundaries), scene_means(*analysis['histogram_change'], boundaries))
+            with scheduler.stage('scene_analysis'):
+                intensity_scores = analyze_scene_intensity(video_path, scene_times, analysis['keyframes'],
+                                                           motion=scene_motion)
+            logger.info(f"Scene intensity analysis completed. Scored scenes: {len(intensity_scores)}")
         except Exception as e:
-            logger.error(f"Scene detection error: {str(e)}")
+            logger.error(f"Scene analysis error: {str(e)}")
         
         # Update progress
-        jobs[job_id]['progress'] = 70
+        job_store.update(job_id, progress=70)
         
         # Determine highlights
         highlights = []
@@ -279,11 +308,12 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
                     highlights.append((start_time, end_time))
         
         # If we don't have enough highlights from merged scores, fall back to scene detection
-        if len(highlights) < num_highlights and scenes_df is not None and len(scenes_df) > 0:
+        if len(highlights) < num_highlights and scene_times:
             scenes_needed = num_highlights - len(highlights)
-            for i in range(min(scenes_needed, len(scenes_df))):
-                start_time = scenes_df.iloc[i]['Start Time (seconds)']
-                max_duration = min(highlight_duration[1], scenes_df.iloc[i]['Length (seconds)'])
+            scene_lengths = np.diff(boundaries)
+            for i in range(min(scenes_needed, len(scene_times))):
+                start_time = scene_times[i][0]
+                max_duration = min(highlight_duration[1], float(scene_lengths[i]))
                 end_time = start_time + max_duration
                 
                 # Ensure we don't exceed clip duration
@@ -291,7 +321,7 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
                     end_time = total_duration
                 
                 # Ensure minimum duration if possible
-                if end_time - start_time < highlight_duration[0] and i < len(scenes_df) - 1:
+                if end_time - start_time < highlight_duration[0] and i < len(scene_times) - 1:
                     end_time = start_time + highlight_duration[0]
                     if end_time > total_duration:
                         end_time = total_duration
@@ -311,7 +341,7 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
                     highlights.append((start_time, end_time))
         
         # Update progress
-        jobs[job_id]['progress'] = 80
+        job_store.update(job_id, progress=80)
         
         # Create highlight videos
         highlight_paths = []
@@ -325,25 +355,37 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
             
             # Create subclip and write to file
             subclip = clip.subclip(start, end)
-            subclip.write_videofile(
-                output_path, 
-                codec='libx264', 
-                audio_codec='aac' if has_audio else None,
-                threads=2,
-                verbose=False,
-                logger=None
-            )
+            with scheduler.stage('render'):
+                subclip.write_videofile(
+                    output_path, 
+                    codec='libx264', 
+                    audio_codec='aac' if has_audio else None,
+                    threads=2,
+                    verbose=False,
+                    logger=None
+                )
             
             highlight_paths.append(output_path)
-            metadata.append({
+            highlight_metadata = {
                 "filename": highlight_name,
                 "start_time": start,
                 "end_time": end,
                 "duration": end - start
-            })
+            }
+            if motion is not None:
+                highlight_metadata["motion"] = window_mean(*motion, start, end)
+            
+            # Thumbnail from the analysis pass, nearest the middle of the highlight
+            thumbnail = nearest_thumbnail(thumbnails, (start + end) / 2) if thumbnails else None
+            if thumbnail:
+                thumbnail_name = f"highlight_{i+1}.jpg"
+                with open(os.path.join(job_folder, thumbnail_name), 'wb') as f:
+                    f.write(thumbnail)
+                highlight_metadata["thumbnail"] = thumbnail_name
+            metadata.append(highlight_metadata)
             
             # Increment progress as each highlight is completed
-            jobs[job_id]['progress'] = 80 + ((i + 1) * 20 // len(highlights))
+            job_store.update(job_id, progress=80 + ((i + 1) * 20 // len(highlights)))
         
         # Save metadata
         with open(os.path.join(job_folder, 'metadata.json'), 'w') as f:
@@ -392,10 +434,7 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
 
         
         # Update job status to complete
-        jobs[job_id]['status'] = 'complete'
-        jobs[job_id]['progress'] = 100
-        jobs[job_id]['result_files'] = highlight_paths
-        jobs[job_id]['metadata'] = metadata
+        job_store.update(job_id, status='complete', progress=100, result_files=highlight_paths, metadata=metadata)
         
         logger.info(f"Job {job_id} completed successfully")
         return True
@@ -403,10 +442,22 @@ def process_video(video_path, job_id, num_highlights=3, highlight_duration=(20,
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
         # Update job status to failed
-        jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['error'] = str(e)
+        job_store.update(job_id, status='failed', error=str(e))
         return False
 
+def recover_jobs():
+    """Re-queue jobs left unfinished by a server process that has stopped"""
+    for job in job_store.recover():
+        if not os.path.exists(job['file_path']):
+            job_store.update(job['id'], status='failed', error='Upload missing after restart')
+            continue
+        logger.info(f"Re-queuing interrupted job {job['id']}")
+        scheduler.submit(job['id'], process_video, job['file_path'], job['id'], job['num_highlights'],
+                         job['highlight_duration'], priority=job['priority'], force=True)
+
+if not RELOADER_PARENT:
+    recover_jobs()
+
 # API Routes
 
 @app.route('/api/uploadToYoutube', methods=['POST'])
@@ -438,17 +489,15 @@ def upload_to_youtube():
 
         # Print for debugging
         print("Received job_id:", job_id)
-        print("Received job_id:", jobs)
 
         
         # Check if job exists
         if not isinstance(job_id, str):
             return jsonify({'error': 'job_id must be a string'}), 400
 
-        if job_id not in jobs:
+        job = job_store.get(job_id)
+        if job is None:
             return jsonify({'error': 'Job not found'}), 404
-            
-        job = jobs[job_id]
         
         # Check if job is complete
         if job.get('status') != 'complete':
@@ -507,6 +556,7 @@ def upload_to_youtube():
             # Save YouTube info in metadata
             highlight_metadata["youtube_id"] = video_id
             highlight_metadata["youtube_url"] = f"https://www.youtube.com/watch?v={video_id}"
+            job_store.update(job_id, metadata=job['metadata'])
             
             return jsonify({
                 'success': True,
@@ -536,6 +586,14 @@ def upload_videoo():
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
+        priority = request.form.get('priority', 'normal')
+        if priority not in PRIORITIES:
+            return jsonify({'error': f"priority must be one of {', '.join(PRIORITIES)}"}), 400
+        
+        # Refuse before storing the upload when nothing more can be queued
+        if scheduler.is_full():
+            return jsonify({'error': 'Too many jobs queued, try again later'}), 429
+        
         # Create a new job ID
         job_id = str(uuid.uuid4())
         
@@ -550,53 +608,50 @@ def upload_videoo():
         max_duration = int(request.form.get('max_duration', 30))
         
         # Initialize job status
-        jobs[job_id] = {
-            'id': job_id,
-            'filename': filename,
-            'file_path': file_path,
-            'status': 'queued',
-            'progress': 0,
-            'created_at': time.time(),
-            'num_highlights': num_highlights,
-            'highlight_duration': (min_duration, max_duration)
-        }
-        
-        # Start processing in a background thread
-        threading.Thread(
-            target=process_video,
-            args=(file_path, job_id, num_highlights, (min_duration, max_duration))
-        ).start()
+        job_store.create(job_id, filename, file_path, num_highlights, (min_duration, max_duration), priority)
+        
+        # Queue for the worker pool
+        try:
+            scheduler.submit(job_id, process_video, file_path, job_id, num_highlights,
+                             (min_duration, max_duration), priority=priority)
+        except QueueFullError:
+            # Another upload took the last slot while this one was being saved
+            job_store.delete(job_id)
+            os.remove(file_path)
+            return jsonify({'error': 'Too many jobs queued, try again later'}), 429
         
         return jsonify({
             'job_id': job_id,
             'status': 'queued',
-            'message': 'Video upload successful. Processing started.'
+            'queue_position': job_store.queue_position(job_id),
+            'message': 'Video upload successful. Processing queued.'
         }), 202
     
     return jsonify({'error': 'File type not allowed'}), 400
 
 @app.route('/api/status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
-    if job_id not in jobs:
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
-    job = jobs[job_id].copy()
-    
     # Don't return internal file paths
     if 'file_path' in job:
         del job['file_path']
     if 'result_files' in job:
         del job['result_files']
     
+    if job['status'] == 'queued':
+        job['queue_position'] = job_store.queue_position(job_id)
+    
     return jsonify(job), 200
 
 @app.route('/api/results/<job_id>', methods=['GET'])
 def get_job_results(job_id):
-    if job_id not in jobs:
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
-    job = jobs[job_id]
-    
     if job['status'] != 'complete':
         return jsonify({
             'status': job['status'],
@@ -613,7 +668,8 @@ def get_job_results(job_id):
             'url': f"/api/download/{job_id}/{metadata['filename']}",
             'duration': metadata['duration'],
             'start_time': metadata['start_time'],
-            'end_time': metadata['end_time']
+            'end_time': metadata['end_time'],
+            'thumbnail_url': f"/api/download/{job_id}/{metadata['thumbnail']}" if 'thumbnail' in metadata else None
         })
     
     return jsonify({
@@ -627,11 +683,11 @@ def get_job_results(job_id):
 @app.route('/api/download/<job_id>/<filename>', methods=['GET'])
 def download_file(job_id, filename):
     # Validate job exists
-    if job_id not in jobs:
+    job = job_store.get(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
     # Validate job is complete
-    job = jobs[job_id]
     if job['status'] != 'complete':
         return jsonify({'error': 'Job is not complete yet'}), 400
     
@@ -646,7 +702,7 @@ def download_file(job_id, filename):
 @app.route('/api/transcript/<job_id>', methods=['GET'])
 def get_transcript(job_id):
     # Validate job exists
-    if job_id not in jobs:
+    if job_store.get(job_id) is None:
         return jsonify({'error': 'Job not found'}), 404
     
     # Validate transcript exists
@@ -665,20 +721,20 @@ def cleanup_old_jobs():
         cutoff_time = time.time() - (hours * 3600)
         
         deleted_jobs = []
-        for job_id, job in list(jobs.items()):
-            if job.get('created_at', 0) < cutoff_time:
-                # Delete job files
-                if 'file_path' in job and os.path.exists(job['file_path']):
-                    os.remove(job['file_path'])
-                
-                # Delete result folder
-                job_folder = os.path.join(RESULTS_FOLDER, job_id)
-                if os.path.exists(job_folder):
-                    shutil.rmtree(job_folder)
-                
-                # Remove job from memory
-                del jobs[job_id]
-                deleted_jobs.append(job_id)
+        for job in job_store.list(created_before=cutoff_time, limit=None):
+            job_id = job['id']
+            # Delete job files
+            if os.path.exists(job['file_path']):
+                os.remove(job['file_path'])
+            
+            # Delete result folder
+            job_folder = os.path.join(RESULTS_FOLDER, job_id)
+            if os.path.exists(job_folder):
+                shutil.rmtree(job_folder)
+            
+            # Remove job from the store
+            job_store.delete(job_id)
+            deleted_jobs.append(job_id)
         
         return jsonify({
             'message': f'Cleaned up {len(deleted_jobs)} old jobs',
@@ -687,12 +743,33 @@ def cleanup_old_jobs():
     except Exception as e:
         return jsonify({'error': f'Cleanup failed: {str(e)}'}), 500
 
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """List jobs newest first, filtered by ?status= and a created_at range (?since=, ?until=, unix times)"""
+    try:
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        jobs = job_store.list(request.args.get('status'), since, until, limit)
+    except Exception as e:
+        return jsonify({'error': f'Listing jobs failed: {str(e)}'}), 500
+    
+    for job in jobs:
+        # Don't return internal file paths
+        job.pop('file_path', None)
+        job.pop('result_files', None)
+    return jsonify(jobs), 200
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    job_counts = job_store.counts()
     return jsonify({
         'status': 'ok',
-        'active_jobs': len(jobs),
+        'active_jobs': sum(job_counts.values()),
+        'jobs': job_counts,
+        'scheduler': scheduler.stats(),
+        'models': model_registry.loaded(),
         'version': '1.0.0'
     }), 200
 
@@ -786,7 +863,7 @@ if __name__ == '__main__':
     # Install required packages if not already installed
     try:
         import pkg_resources
-        required_packages = ['moviepy', 'scenedetect[opencv]', 'whisper', 'spacy', 'flask', 'flask-cors']
+        required_packages = ['moviepy', 'opencv-python', 'whisper', 'spacy', 'flask', 'flask-cors']
         installed = {pkg.key for pkg in pkg_resources.working_set}
         missing = [pkg for pkg in required_packages if pkg.split('[')[0] not in installed]
         